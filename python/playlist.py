@@ -33,11 +33,10 @@ import re
 import socket
 import subprocess
 
-import docopt # PyPI: docopt
-import mpd # PyPI: python-mpd2
-
 import syncbin
 
+docopt, mpd = syncbin.pypi_imports('docopt', ('mpd', 'python-mpd2'))
+
 __version__ = syncbin.__version__
 
 MPD_ROOT = pathlib.Path(os.environ.get('MPD_ROOT', '/Users/fenhl/Music'))
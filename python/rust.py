@@ -2,6 +2,8 @@
 
 """Update the Rust install and (if in a project directory) build the project.
 
+Toolchains are only updated if there has been a release since they were installed, see outdated_toolchains.
+
 Usage:
   rust [options]
   rust current
@@ -15,10 +17,11 @@ Options:
   -R, --release        Build with the `--release' flag and skip tests.
   -T, --no-test        Skip the `cargo test` step.
   -c, --crates         Update Cargo.lock even if not ignored.
+  -f, --force          Build and test even if nothing changed since the last successful build, and check for toolchain updates even if they were checked recently.
   -h, --help           Print this message and exit.
   -q, --quiet          Don't print progress.
-  -r, --run            Add a `cargo run' step at the end.
-  --all-projects       Update all git repos listed at $XDG_CONFIG_DIRS/fenhl/syncbin.json instead of just the current directory.
+  -r, --run            Add a `cargo run' step at the end. Ignored with `--all-projects'.
+  --all-projects       Update all git repos listed at $XDG_CONFIG_DIRS/fenhl/syncbin.json instead of just the current directory. Repos are fetched concurrently and built a few at a time, then a summary is printed. If `rust.sharedTargetDir' is set in that file, all projects are built into one target directory, see syncbin_cargo.py.
   --all-toolchains     Update all Rust toolchains.
   --no-project         Only update Rust itself, don't attempt to update any git repo or cargo project.
   --no-timeout         Don't automatically abort the update process of a toolchain. Overrides `--timeout'.
@@ -32,12 +35,20 @@ import sys
 sys.path += ['/opt/py', str(pathlib.Path.home() / 'py')]
 
 import basedir
+import concurrent.futures
+import contextlib
 import docopt
+import hashlib
+import json
 import os
 import re
 import shutil
 import subprocess
 import syncbin
+import syncbin_cargo
+import syncbin_rustup
+import threading
+import time
 
 try:
     with pathlib.Path(os.environ.get('GITDIR', '/opt/git'), 'github.com', 'fenhl', 'syncbin', 'master', 'version.txt').open() as version_file:
@@ -45,18 +56,168 @@ try:
 except Exception:
     __version__ = '0.0'
 
+_builds_lock = threading.Lock()
+_toolchains_lock = threading.Lock()
+DEFAULT_TOOLCHAIN_FRESHNESS = 60 * 60 # seconds
+BUILD_CORES_PER_JOB = 4 # cargo parallelizes each build itself, so `--all-projects` only runs a few builds at once
 QUIET = False
 
+class Project:
+    """A project updated by `rust --all-projects`, with its captured output and the outcome of each phase."""
+
+    def __init__(self, path):
+        self.path = path
+        self.package_sets = [] # each is built and tested separately, an empty list means the whole workspace
+        self.output = []
+        self.status = 'queued'
+        self.exit_status = 0
+        self.durations = {}
+
+    def run(self, cmd, *, artifacts=None):
+        """Runs cmd in the project directory and captures its output. If artifacts is a set, cmd must be a cargo command with `--message-format=json-render-diagnostics`, and the paths of the artifacts it reports are added to the set."""
+        if artifacts is None:
+            result = subprocess.run(cmd, cwd=str(self.path), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding='utf-8', errors='replace')
+            output = result.stdout
+        else:
+            result = subprocess.run(cmd, cwd=str(self.path), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8', errors='replace')
+            output = result.stderr
+            for line in result.stdout.splitlines(keepends=True):
+                if line.startswith('{'):
+                    try:
+                        artifacts.update(syncbin_cargo.artifacts(json.loads(line)))
+                        continue
+                    except ValueError:
+                        pass
+                output += line # e.g. output of the test harness
+        while cmd[0] == '/usr/bin/env' or '=' in cmd[0]:
+            cmd = cmd[1:] # skip the environment added by env()
+        self.output.append('$ {}\n{}'.format(' '.join(cmd), output))
+        return result.returncode
+
+    def fail(self, status, exit_status):
+        self.status = status
+        self.exit_status = exit_status or 1
+
+def all_projects(config):
+    """Returns the projects from the config in order, merging entries for the same path."""
+    projects = {}
+    for project, packages in config.get('rust', {}).get('packages', {}).items():
+        projects.setdefault(pathlib.Path(project), Project(pathlib.Path(project))).package_sets.append(packages)
+    for path in map(pathlib.Path, config.get('rust', {}).get('projects', [])):
+        projects.setdefault(path, Project(path)).package_sets.append([])
+    return list(projects.values())
+
+def build_fingerprint(path, arguments, packages=(), *, target_dir=None):
+    """Returns a JSON-compatible value identifying the inputs of a build, or None if they can't be determined, e.g. because there are uncommitted changes."""
+    head = subprocess.run(['git', 'rev-parse', '--verify', '--quiet', 'HEAD'], cwd=str(path), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8')
+    if head.returncode != 0:
+        return None # not a git repo, so there's no cheap way to tell whether the sources changed
+    if subprocess.run(['git', 'status', '--porcelain'], cwd=str(path), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8').stdout:
+        return None
+    if not pathlib.Path(target_dir or os.environ.get('CARGO_TARGET_DIR') or path / 'target').is_dir():
+        return None # e.g. after `cargo clean`
+    rustc = subprocess.run(env('rustc', '-V'), cwd=str(path), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8')
+    if rustc.returncode != 0:
+        return None
+    try:
+        with (path / 'Cargo.lock').open('rb') as lock_f:
+            cargo_lock = hashlib.sha256(lock_f.read()).hexdigest()
+    except FileNotFoundError:
+        cargo_lock = None
+    return {
+        'cargoLock': cargo_lock,
+        'head': head.stdout.strip(),
+        'packages': list(packages),
+        'release': bool(arguments['--release']),
+        'rustc': rustc.stdout.strip(),
+        'targetDir': None if target_dir is None else str(target_dir),
+        'test': not (arguments['--release'] or arguments['--no-test']),
+    }
+
+def build_key(path, packages=()):
+    return ' '.join([str(path.resolve()), *package_args(packages)])
+
+def build_project(project, arguments, *, target_dir=None):
+    """Builds and tests the project, into target_dir if given, which is shared with other projects."""
+    start = time.monotonic()
+    project.status = 'building'
+    built = False
+    if target_dir is None:
+        cargo_env = {}
+        cargo_args = []
+        artifacts = None
+        target_lock = contextlib.nullcontext()
+    else:
+        cargo_env = {'CARGO_TARGET_DIR': str(target_dir)}
+        cargo_args = ['--message-format=json-render-diagnostics'] # to record which units are still in use
+        artifacts = set()
+        target_lock = syncbin.lock('rust-target', shared=True) # cargo locks the target dir itself while building, this is to prevent eviction
+    with target_lock:
+        for packages in project.package_sets:
+            previous_artifacts = built_artifacts(project.path, arguments, packages, target_dir=target_dir)
+            if previous_artifacts is not None:
+                if artifacts is not None:
+                    artifacts.update(previous_artifacts) # still in use, so they shouldn't be evicted
+                continue
+            built = True
+            package_artifacts = None if artifacts is None else set()
+            exit_status = project.run(env('cargo', 'build', *(['--release'] if arguments['--release'] else []), *cargo_args, *package_args(packages), **cargo_env), artifacts=package_artifacts)
+            if exit_status == 0 and not (arguments['--release'] or arguments['--no-test']):
+                exit_status = project.run(env('cargo', 'test', *cargo_args, *package_args(packages), **cargo_env), artifacts=package_artifacts)
+                status = 'tests failed'
+            else:
+                status = 'build failed'
+            if package_artifacts is not None:
+                artifacts.update(package_artifacts)
+            if exit_status != 0:
+                project.fail(status, exit_status)
+                break
+            record_build(project.path, arguments, packages, target_dir=target_dir, artifacts=package_artifacts)
+        else:
+            project.status = 'ok' if built else 'unchanged'
+        if artifacts:
+            syncbin_cargo.record_usage(target_dir, artifacts)
+    project.durations['build'] = time.monotonic() - start
+
+def built_artifacts(path, arguments, packages=(), *, target_dir=None):
+    """If the last successful build of the project had the same inputs as the current one would, returns the artifacts it reported. Otherwise, returns None.
+
+    The artifacts are only recorded for builds into a shared target dir (and the list is empty otherwise). There, a build is only considered current if its artifacts haven't been evicted since.
+    """
+    if arguments['--force']:
+        return None
+    fingerprint = build_fingerprint(path, arguments, packages, target_dir=target_dir)
+    if fingerprint is None:
+        return None
+    record = syncbin.load_cache('rust-builds.json', default={}).get(build_key(path, packages))
+    if record is None:
+        return None
+    record = dict(record)
+    artifacts = record.pop('artifacts', None)
+    if record != fingerprint:
+        return None
+    if target_dir is None:
+        return []
+    if artifacts is None or not all(os.path.exists(artifact) for artifact in artifacts):
+        return None
+    return artifacts
+
 def current_toolchain(cwd=None):
     return override(cwd) or default_toolchain()
 
 def default_toolchain():
+    try:
+        toolchain = syncbin_rustup.default_toolchain()
+    except (OSError, ValueError):
+        pass # fall back to asking rustup
+    else:
+        return None if toolchain is None else syncbin_rustup.short_name(toolchain)
     show_default = subprocess.Popen(env('rustup', 'show'), stdout=subprocess.PIPE)
     out, _ = show_default.communicate(timeout=5)
     for line in out.decode('utf-8').split('\n'):
         if line == 'no active toolchain':
             return None
-        if '(default)' not in line:
+        if 'default)' not in line: # `(default)` or `(active, default)` depending on the rustup version
             continue
         match = line.split('-')[0]
         for formatting_prefix in {'\x1b(B\x1b[m', '\x1b[m\x0f'}:
@@ -66,12 +227,64 @@ def default_toolchain():
     else:
         raise NotImplementedError('Failed to parse default toolchain')
 
-def env(*args):
-    return ['/usr/bin/env', 'PATH={}:{}'.format(pathlib.Path.home() / '.cargo' / 'bin', os.environ['PATH']), *args]
+def dist_server(config):
+    """The rustup dist server, from `rust.distServer' in syncbin.json or `RUSTUP_DIST_SERVER' like in rustup."""
+    return config.get('rust', {}).get('distServer') or os.environ.get('RUSTUP_DIST_SERVER') or syncbin_rustup.DEFAULT_DIST_SERVER
+
+def env(*args, **env_vars):
+    return ['/usr/bin/env', 'PATH={}:{}'.format(pathlib.Path.home() / '.cargo' / 'bin', os.environ['PATH']), *(f'{name}={value}' for name, value in env_vars.items()), *args]
+
+def is_built(path, arguments, packages=(), *, target_dir=None):
+    """Whether the last successful build of the project had the same inputs as the current one would, so it can be skipped."""
+    return built_artifacts(path, arguments, packages, target_dir=target_dir) is not None
+
+def outdated_toolchains(toolchains, config, *, force=False):
+    """Returns the toolchains among the given ones which need `rustup update`, in the given order.
+
+    A toolchain is current if the hash of its channel manifest on the dist server is the one rustup recorded when installing it. The manifest hashes of all channels are downloaded concurrently, so this is done for all toolchains before any of them is updated. The result of each check is cached in the syncbin cache, together with the installed version, and a toolchain which was found to be current less than `rust.toolchainFreshness' seconds ago (default 1 hour) isn't checked again unless force is true or rustup has updated it since. Toolchains which aren't installed or can't be checked are left to rustup.
+    """
+    freshness = config.get('rust', {}).get('toolchainFreshness', DEFAULT_TOOLCHAIN_FRESHNESS)
+    server = dist_server(config)
+    cache = syncbin.load_cache('rust-toolchains.json', default={})
+    now = time.time()
+
+    def check(toolchain):
+        full_name = syncbin_rustup.full_name(toolchain)
+        if full_name is None:
+            return True, None
+        installed_hash = syncbin_rustup.update_hash(full_name)
+        if installed_hash is None:
+            return True, None
+        record = cache.get(full_name)
+        if not force and record is not None and record['hash'] == installed_hash and now - record['checked'] < freshness:
+            return False, None
+        try:
+            latest_hash = syncbin_rustup.channel_hash(toolchain, server)
+        except OSError:
+            return True, None # rustup will report the error
+        if not syncbin_rustup.is_current(full_name, latest_hash):
+            return True, None
+        return False, (full_name, {'hash': installed_hash, 'checked': now, 'version': syncbin_rustup.installed_version(full_name)})
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(toolchains))) as executor:
+        results = list(executor.map(check, toolchains))
+    records = [record for _, record in results if record is not None]
+    if records:
+        with _toolchains_lock:
+            cache = syncbin.load_cache('rust-toolchains.json', default={})
+            cache.update(records)
+            syncbin.save_cache('rust-toolchains.json', cache)
+    return [toolchain for toolchain, (outdated, _) in zip(toolchains, results) if outdated]
 
 def override(cwd=None):
     if cwd is None:
         cwd = pathlib.Path().resolve()
+    try:
+        toolchain, _ = syncbin_rustup.find_override(cwd)
+    except (OSError, ValueError):
+        pass # fall back to asking rustup
+    else:
+        return None if toolchain is None else syncbin_rustup.short_name(toolchain)
     overrides_out = subprocess.run(env('rustup', 'override', 'list'), stdout=subprocess.PIPE, check=True, encoding='utf-8').stdout
     if overrides_out == 'no overrides\n':
         return
@@ -81,13 +294,43 @@ def override(cwd=None):
         if path == cwd or path in cwd.parents:
             return override.split('-')[0]
 
+def package_args(packages):
+    return [f'--package={package}' for package in packages]
+
 def quiet():
     if QUIET:
         yield '--quiet'
 
+def record_build(path, arguments, packages=(), *, target_dir=None, artifacts=None):
+    fingerprint = build_fingerprint(path, arguments, packages, target_dir=target_dir) # after the build, since it can change Cargo.lock
+    if fingerprint is not None:
+        if artifacts is not None:
+            fingerprint['artifacts'] = sorted(artifacts)
+        with _builds_lock:
+            builds = syncbin.load_cache('rust-builds.json', default={})
+            builds[build_key(path, packages)] = fingerprint
+            syncbin.save_cache('rust-builds.json', builds)
+
+def record_toolchain(toolchain):
+    """Records that the toolchain was just updated, so outdated_toolchains considers it current for a while."""
+    full_name = syncbin_rustup.full_name(toolchain)
+    if full_name is None:
+        return
+    installed_hash = syncbin_rustup.update_hash(full_name)
+    if installed_hash is None:
+        return
+    with _toolchains_lock:
+        cache = syncbin.load_cache('rust-toolchains.json', default={})
+        cache[full_name] = {'hash': installed_hash, 'checked': time.time(), 'version': syncbin_rustup.installed_version(full_name)}
+        syncbin.save_cache('rust-toolchains.json', cache)
+
 def rprompt(cwd=None):
     if cwd is None:
         cwd = pathlib.Path().resolve()
+    try:
+        return syncbin_rustup.rprompt(cwd)
+    except (OSError, ValueError):
+        pass # fall back to asking rustup
     overrides_out = subprocess.run(env('rustup', 'override', 'list'), stdout=subprocess.PIPE, check=True, encoding='utf-8').stdout
     if '(not a directory)' in overrides_out:
         return '[rust: nonexistent]'
@@ -99,11 +342,21 @@ def rprompt(cwd=None):
         if result is not None:
             return '[rust: {}]'.format(result)
 
-def rustup_update(toolchain=None, timeout=300):
+def run_maintenance(maintenance):
+    """Runs the maintenance actions queued by rustup_update, each at most once."""
+    if 'sweep' in maintenance:
+        syncbin_cargo.sweep(pathlib.Path(os.environ.get('GITDIR', '/opt/git')))
+    if 'self-update' in maintenance:
+        with syncbin.lock('rust'): # see https://github.com/rust-lang/rustup.rs/issues/988
+            subprocess.check_call(env('rustup', 'self', 'update'), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def rustup_update(toolchain=None, timeout=300, *, maintenance=None):
+    """Updates the toolchain, then sweeps old build artifacts and updates rustup itself. If maintenance is a set, the latter two are added to it instead, to be run once for all updated toolchains by run_maintenance."""
     if toolchain is None:
         toolchain = current_toolchain()
+    config = basedir.config_dirs('fenhl/syncbin.json').json(base={})
     with syncbin.lock('rust'): # see https://github.com/rust-lang/rustup.rs/issues/988
-        update_popen = subprocess.Popen(env('rustup', 'update', toolchain), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        update_popen = subprocess.Popen(env('rustup', 'update', toolchain, RUSTUP_DIST_SERVER=dist_server(config)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     try:
         if update_popen.wait(timeout=timeout) != 0:
             print('[!!!!]', 'updating Rust {}: failed'.format(toolchain), file=sys.stderr)
@@ -112,9 +365,14 @@ def rustup_update(toolchain=None, timeout=300):
         update_popen.terminate()
         print('[!!!!]', 'updating Rust {}: timed out'.format(toolchain), file=sys.stderr)
         sys.exit(update_popen.returncode)
-    subprocess.run(env('cargo', 'sweep', '--installed', '-r'), cwd=os.environ.get('GITDIR', '/opt/git'), stdout=subprocess.DEVNULL, check=True)
-    with syncbin.lock('rust'): # see https://github.com/rust-lang/rustup.rs/issues/988
-        subprocess.check_call(env('rustup', 'self', 'update'), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    record_toolchain(toolchain)
+    queue = set() if maintenance is None else maintenance
+    if syncbin_cargo.shared_target_dir(config) is None:
+        queue.add('sweep')
+    # otherwise, artifacts for old toolchains are evicted from the shared target dir by `--all-projects` once they're the least recently used
+    queue.add('self-update')
+    if maintenance is None:
+        run_maintenance(queue)
 
 def set_status(progress, message, newline=False):
     if QUIET:
@@ -124,6 +382,52 @@ def set_status(progress, message, newline=False):
     else:
         print('[' + '=' * progress + '.' * (4 - progress) + ']', message, end='\n' if newline else '\r')
 
+def update_all_projects(arguments):
+    """Updates the projects listed in the config. Fetching and updating crates is network-bound and runs for all projects at once, while builds are limited to a pool sized to the number of CPU cores. Returns the exit status."""
+    config = basedir.config_dirs('fenhl/syncbin.json').json(base={})
+    projects = all_projects(config)
+    target_dir = syncbin_cargo.shared_target_dir(config)
+    start = time.time()
+    finished = 0
+    status_lock = threading.Lock()
+
+    def network_phase(project):
+        nonlocal finished
+        update_sources(project, arguments)
+        with status_lock:
+            finished += 1
+            set_status(4, 'updating projects ({}/{} fetched)'.format(finished, len(projects)))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, (os.cpu_count() or 1) // BUILD_CORES_PER_JOB)) as build_pool:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(projects))) as network_pool:
+            network_futures = {network_pool.submit(network_phase, project): project for project in projects}
+            build_futures = []
+            for future in concurrent.futures.as_completed(network_futures):
+                future.result()
+                project = network_futures[future]
+                if project.exit_status == 0:
+                    # start building as soon as this project is fetched, while others are still being fetched
+                    build_futures.append(build_pool.submit(build_project, project, arguments, target_dir=target_dir))
+        for future in build_futures:
+            future.result()
+    if target_dir is not None and target_dir.exists():
+        set_status(4, 'evicting unused build artifacts   ')
+        evicted, freed = syncbin_cargo.evict(target_dir, syncbin_cargo.max_size(config), keep_since=start)
+        if evicted and not QUIET:
+            print('[ ** ]', 'evicted {} units ({:.1f} MiB) from {}'.format(evicted, freed / 1024 ** 2, target_dir))
+    set_status(5, 'update complete                    ')
+    for project in projects:
+        if project.exit_status != 0:
+            print('[!!!!] {}: {}'.format(project.path, project.status), file=sys.stderr)
+            print(''.join(project.output).rstrip('\n'), file=sys.stderr)
+    if not QUIET or any(project.exit_status != 0 for project in projects):
+        max_len = max([len('project'), *(len(str(project.path)) for project in projects)])
+        print('{}  {:>8}  {:>8}  {}'.format('project'.ljust(max_len), 'update', 'build', 'status'))
+        for project in projects:
+            print('{}  {}  {}  {}'.format(str(project.path).ljust(max_len), *('{:>7.1f}s'.format(project.durations[phase]) if phase in project.durations else ' ' * 8 for phase in ('update', 'build')), project.status))
+    # the first failure in config order, so the exit status doesn't depend on timing
+    return next((project.exit_status for project in projects if project.exit_status != 0), 0)
+
 def update_project(path, arguments, packages=()):
     if subprocess.call(['git', 'branch'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=str(path)) == 0:
         set_status(3, 'updating repo        ')
@@ -145,16 +449,23 @@ def update_project(path, arguments, packages=()):
         elif not QUIET:
             print('[ ** ]', 'Cargo.lock tracked by git, skipping crates update step, `--crates` to override')
     set_status(5, 'update complete')
-    cargo_build = subprocess.Popen(env('cargo', 'build', *(['--release'] if arguments['--release'] else []), *quiet(), *(f'--package={package}' for package in packages)), cwd=str(path))
-    if cargo_build.wait() != 0:
-        return cargo_build.returncode
-    if arguments['--release'] or arguments['--no-test']:
+    if is_built(path, arguments, packages):
+        if not QUIET:
+            print('[ ** ]', 'nothing changed since the last successful build, skipping build and test steps, `--force` to override')
         exit_status = 0
     else:
-        exit_status = subprocess.call(env('cargo', 'test', *quiet(), *(f'--package={package}' for package in packages)), cwd=str(path))
+        cargo_build = subprocess.Popen(env('cargo', 'build', *(['--release'] if arguments['--release'] else []), *quiet(), *package_args(packages)), cwd=str(path))
+        if cargo_build.wait() != 0:
+            return cargo_build.returncode
+        if arguments['--release'] or arguments['--no-test']:
+            exit_status = 0
+        else:
+            exit_status = subprocess.call(env('cargo', 'test', *quiet(), *package_args(packages)), cwd=str(path))
+        if exit_status == 0:
+            record_build(path, arguments, packages)
     if exit_status == 0 and arguments['--run']:
         try:
-            return subprocess.call(env('cargo', 'run', *(['--release'] if arguments['--release'] else []), *quiet(), *(f'--package={package}' for package in packages)), cwd=str(path))
+            return subprocess.call(env('cargo', 'run', *(['--release'] if arguments['--release'] else []), *quiet(), *package_args(packages)), cwd=str(path))
         except KeyboardInterrupt:
             print()
             return 130
@@ -164,6 +475,34 @@ def update_project(path, arguments, packages=()):
     else:
         return exit_status
 
+def update_sources(project, arguments):
+    start = time.monotonic()
+    project.status = 'updating'
+    path = project.path
+    try:
+        if subprocess.call(['git', 'branch'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=str(path)) == 0:
+            exit_status = project.run(['git', 'fetch'])
+            if exit_status != 0:
+                project.fail('fetch failed', exit_status)
+                return
+            exit_status = project.run(['git', 'merge', 'FETCH_HEAD'])
+            if exit_status != 0:
+                project.run(['git', 'merge', '--abort'])
+                project.fail('merge failed', exit_status)
+                return
+        if (path / 'Cargo.lock').exists(): # `cargo update` complains if no Cargo.lock exists yet
+            if arguments['--crates'] or subprocess.call(['git', 'check-ignore', 'Cargo.lock'], stdout=subprocess.DEVNULL, cwd=str(path)) == 0:
+                exit_status = project.run(env('cargo', 'update'))
+                if exit_status != 0:
+                    project.fail('updating crates failed', exit_status)
+                    return
+        project.status = 'updated'
+    except OSError as e:
+        project.output.append(f'{e}\n')
+        project.fail('update failed', 1) # e.g. the project directory doesn't exist
+    finally:
+        project.durations['update'] = time.monotonic() - start
+
 if __name__ == '__main__':
     arguments = docopt.docopt(__doc__, version='rust from fenhl/syncbin ' + __version__)
     if arguments['current']:
@@ -189,29 +528,23 @@ if __name__ == '__main__':
         timeout = None
     else:
         timeout = int(arguments['--timeout'])
-    if arguments['--all-toolchains']:
-        set_status(0, 'updating Rust nightly')
-        rustup_update('nightly', timeout=timeout)
-        set_status(1, 'updating Rust beta   ')
-        rustup_update('beta', timeout=timeout)
-        set_status(2, 'updating Rust stable')
-        rustup_update('stable', timeout=timeout)
-    else:
-        toolchain = current_toolchain()
-        set_status(0, 'updating Rust {}'.format(toolchain))
-        rustup_update(toolchain, timeout=timeout)
+    maintenance = set()
+    toolchains = ['nightly', 'beta', 'stable'] if arguments['--all-toolchains'] else [current_toolchain()]
+    set_status(0, 'checking Rust updates')
+    outdated = outdated_toolchains(toolchains, basedir.config_dirs('fenhl/syncbin.json').json(base={}), force=arguments['--force'])
+    for progress, toolchain in enumerate(toolchains):
+        if toolchain in outdated:
+            set_status(progress, 'updating Rust {}'.format(toolchain).ljust(21))
+            rustup_update(toolchain, timeout=timeout, maintenance=maintenance)
+    if maintenance:
+        set_status(2, 'cleaning up'.ljust(21))
+    run_maintenance(maintenance)
     if arguments['--no-project']:
         set_status(5, 'update complete      ')
     elif arguments['--all-projects']:
         set_status(3, 'updating installed crates')
         subprocess.check_call(env('cargo', 'install-update', *quiet(), '--all', '--git'), stdout=subprocess.DEVNULL)
         subprocess.run(['rm', '-rf', '/tmp/cargo-update'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) # for some reason, cargo-update sometimes doesn't clean up its tempfiles?
-        config = basedir.config_dirs('fenhl/syncbin.json').json(base={})
-        for project, packages in config.get('rust', {}).get('packages', {}).items():
-            exit_status = update_project(pathlib.Path(project), arguments, packages=packages)
-        for path in map(pathlib.Path, config.get('rust', {}).get('projects', [])):
-            exit_status = update_project(path, arguments)
-            if exit_status != 0:
-                sys.exit(exit_status)
+        sys.exit(update_all_projects(arguments))
     else:
         sys.exit(update_project(pathlib.Path(), arguments))
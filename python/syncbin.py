@@ -3,42 +3,86 @@
 """Config and helper tool for Fenhl's syncbin.
 
 Usage:
-  syncbin bootstrap [<setup>...]
-  syncbin hasinet
+  syncbin bootstrap [--refresh] [<setup>...]
+  syncbin check-deps [--json] [--refresh]
+  syncbin has-cronjob [--refresh] <pattern>...
+  syncbin hasinet [--refresh] [--target=<host:port>]
   syncbin install
-  syncbin startup [--ignore-lock] [--no-internet-test]
+  syncbin lock-stats
+  syncbin prompt-bench [--runs=<n>] [<segment>...]
+  syncbin prompt-daemon
+  syncbin rprompt [--bench] [--deadline=<s>] [--runs=<n>]
+  syncbin startup [--ignore-lock] [--no-internet-test] [--trace=<file>]
+  syncbin startup-report [--last=<n>]
   syncbin update [public | private | hooks] [<old> <new>]
+  syncbin update --all [--jobs=<n>] [--timeout=<s>]
   syncbin -h | --help
   syncbin --version
 
 Options:
   -h, --help          Print this message and exit.
-  --ignore-lock       When used with the `startup' subcommand, release and ignore the lock that prevents the startup script from running multiple times at once.
-  --no-internet-test  When used with the `startup' subcommand, do not run `syncbin-hasinet' to test for internet connectivity, but run all other startup scripts regardless.
+  --all               When used with the `update' subcommand, fetch all repos managed by syncbin (including oh-my-zsh and the gitdir checkouts) concurrently, update them, and print a summary.
+  --bench             When used with the `rprompt' subcommand, print how long each segment takes instead of the prompt.
+  --deadline=<s>      When used with the `rprompt' subcommand, show the last output of a segment (or `…' if there is none) if it takes longer than this many seconds [Default: 0.3].
+  --ignore-lock       When used with the `startup' subcommand, ignore the locks that prevent the startup script from running multiple times at once.
+  --jobs=<n>          When used with `update --all', fetch this many repos at once [Default: 8].
+  --json              When used with the `check-deps' subcommand, print the status of every required module as a JSON object instead of the missing packages.
+  --last=<n>          When used with the `startup-report' subcommand, aggregate this many of the most recent startup runs [Default: 20].
+  --no-internet-test  When used with the `startup' subcommand, do not test for internet connectivity, but run all other startup scripts regardless.
+  --refresh           When used with the `bootstrap', `check-deps', `has-cronjob', or `hasinet' subcommand, don't use cached results of a previous check.
+  --runs=<n>          When used with the `prompt-bench' subcommand or `rprompt --bench', run each segment this many times [Default: 10].
+  --target=<host:port>  When used with the `hasinet' subcommand, check whether this host and port can be reached instead of $SYNCBIN_HASINET_TARGET or fenhl.net:443.
+  --timeout=<s>       When used with `update --all', give up fetching a repo after this many seconds [Default: 60].
+  --trace=<file>      When used with the `startup' subcommand, write the timing of each startup script to this file, in Chrome's trace event format if it ends in `.json', or as JSON lines otherwise.
   --version           Print version info and exit.
 """
 
 import sys
 
-import contextlib
-import getpass
-import importlib
-import pathlib
 import os
-import subprocess
-import json
-import platform
-import shutil
-import stat
-import time
 
-try:
-    from docopt import docopt
-except ImportError:
-    if __name__ == '__main__':
-        print('[ !! ] docopt not installed, defaulting to `syncbin bootstrap python`', file=sys.stderr)
+# Every tool in syncbin imports this module just for `__version__`, so importing it should be cheap.
+# Heavier standard library modules are imported inside the functions using them, and the bootstrap setups live in `syncbin_bootstrap`.
 
-BOOTSTRAP_SETUPS = {}
+def __getattr__(name):
+    if name == '__version__':
+        global __version__
+
+        __version__ = version()
+        return __version__
+    if name == 'BOOTSTRAP_SETUPS' or name.startswith('bootstrap'):
+        import syncbin_bootstrap
+
+        return getattr(syncbin_bootstrap, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def check_deps(*, refresh=False):
+    """Checks which of the modules in the requirements manifest can be found, without importing them.
+
+    Returns a dict mapping each module name to a dict with the package providing it and whether it was found. A result where all modules were found is cached in the syncbin cache directory until a directory on sys.path changes.
+    """
+    import importlib.util
+
+    requirements = python_requirements()
+    path_mtimes = {}
+    for path_entry in sys.path:
+        try:
+            path_mtimes[path_entry] = os.stat(path_entry or '.').st_mtime_ns
+        except OSError:
+            path_mtimes[path_entry] = None
+    key = {'executable': sys.executable, 'requirements': requirements, 'path': path_mtimes}
+    if not refresh and load_cache('check-deps.json', default={}).get('key') == key:
+        return {module: {'package': package, 'found': True} for module, package in requirements.items()}
+    result = {}
+    for module, package in requirements.items():
+        try:
+            found = importlib.util.find_spec(module) is not None
+        except (ImportError, ValueError):
+            found = False
+        result[module] = {'package': package, 'found': found}
+    if all(status['found'] for status in result.values()):
+        save_cache('check-deps.json', {'key': key})
+    return result
 
 def choose(question, answers):
     answer = input('[ ?? ] {} [{}] '.format(question, '/'.join(short for short, long in answers)))
@@ -49,6 +93,9 @@ def choose(question, answers):
         answer = input('[ ?? ] unrecognized answer, type {}: '.format(' or '.join(f'“{long}”' for short, long in answers)))
 
 def git_dir(existing_only=True):
+    import contextlib
+    import pathlib
+
     with contextlib.suppress(ImportError):
         import gitdir
 
@@ -65,11 +112,75 @@ def git_dir(existing_only=True):
     else:
         return pathlib.Path(os.environ.get('GITDIR', '/opt/git' if root() else '{}/git'.format(os.environ['HOME'])))
 
-def get_os():
-    result = subprocess.run(['uname', '-s'], stdout=subprocess.PIPE, encoding='utf-8', check=True).stdout[:-1]
+def boot_id():
+    """Returns a string identifying the current boot of this machine, used to invalidate caches that are only valid until the next reboot."""
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as boot_id_f:
+            return boot_id_f.read().strip()
+    except OSError:
+        # not Linux, use the boot time instead. The monotonic clock may pause during sleep on some platforms, which only makes the cache expire early.
+        import time
+
+        return str(round(time.time() - time.monotonic(), -1))
+
+def cache_dir():
+    import pathlib
+
+    return pathlib.Path(os.environ.get('XDG_CACHE_HOME') or pathlib.Path.home() / '.cache') / 'syncbin'
+
+def load_cache(name, default=None):
+    import json
+
+    try:
+        with (cache_dir() / name).open() as cache_f:
+            return json.load(cache_f)
+    except (OSError, ValueError):
+        return default
+
+def save_cache(name, value):
+    import json
+    import threading
+
+    path = cache_dir() / name
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tmp_path.open('w') as cache_f:
+            json.dump(value, cache_f, indent=4, sort_keys=True)
+            print(file=cache_f)
+        tmp_path.replace(path)
+    except OSError:
+        pass # caches are an optimization, a read-only home directory shouldn't break anything
+
+OS_RELEASE_IDS = { # the `ID` field in /etc/os-release → the output of `lsb_release -si`
+    'arch': 'Arch',
+    'centos': 'CentOS',
+    'debian': 'Debian',
+    'fedora': 'Fedora',
+    'linuxmint': 'Linuxmint',
+    'raspbian': 'Raspbian',
+    'ubuntu': 'Ubuntu',
+}
+
+def _probe_os():
+    import pathlib
+    import shutil
+    import subprocess
+
+    result = os.uname().sysname
     if result == 'Linux':
-        if shutil.which('lsb_release') is not None:
+        try:
+            with open('/etc/os-release') as os_release_f:
+                os_release = {key: value.strip().strip('"\'') for key, value in (line.split('=', 1) for line in os_release_f if '=' in line)}
+        except OSError:
+            os_release = {}
+        like = [os_release.get('ID', ''), *os_release.get('ID_LIKE', '').split()]
+        if os_release.get('ID') in OS_RELEASE_IDS:
+            result = OS_RELEASE_IDS[os_release['ID']]
+        elif shutil.which('lsb_release') is not None:
             result = subprocess.run(['lsb_release', '-si'], stdout=subprocess.PIPE, encoding='utf-8', check=True).stdout[:-1]
+        elif any(os_id in OS_RELEASE_IDS for os_id in like):
+            result = next(OS_RELEASE_IDS[os_id] for os_id in like if os_id in OS_RELEASE_IDS) # a derivative without lsb_release, named after the distro it's based on
         elif pathlib.Path('/etc/redhat-release').exists():
             with open('/etc/redhat-release') as redhat_release_f:
                 result = redhat_release_f.read().split(' ')[0]
@@ -85,59 +196,130 @@ def get_os():
         raise RuntimeError('Unknown OS: {}'.format(result))
     return result
 
-@contextlib.contextmanager
-def lock(lock_name):
-    path = pathlib.Path(f'/tmp/syncbin-startup-{lock_name}.lock').resolve()
-    while True:
-        try:
-            path.mkdir()
-        except FileExistsError:
-            try:
-                import psutil
-            except ImportError:
-                pass # don't check pid file if psutil is missing
-            else:
-                if (path / 'pid').exists():
-                    with (path / 'pid').open() as pid_f:
-                        pid = int(pid_f.read().strip())
-                    if not psutil.pid_exists(pid):
-                        with contextlib.suppress(FileNotFoundError): #TODO (Python 3.8) remove suppress context and use unlink(missing_ok=True) instead
-                            (path / 'pid').unlink()
-                        path.rmdir()
-            time.sleep(1)
-            continue
-        break
+def _probe_root():
+    import getpass
+    import re
+    import subprocess
+
+    if getpass.getuser() == 'root':
+        return True
+    # `sudo -n true` also succeeds while a password entered earlier is still cached by sudo, which would make this fact wrong until the next reboot. `sudo -n -l` lists the user's sudo rules, and only a rule allowing everything without a password counts.
     try:
-        with (path / 'pid').open('w') as pid_f:
-            print(os.getpid(), file=pid_f)
-        yield path
-    finally:
-        with contextlib.suppress(FileNotFoundError): #TODO (Python 3.8) remove suppress context and use unlink(missing_ok=True) instead
-            (path / 'pid').unlink()
-        path.rmdir()
+        result = subprocess.run(['sudo', '-n', '-l'], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8', errors='replace')
+    except FileNotFoundError:
+        return False # sudo not installed
+    return result.returncode == 0 and re.search(r'NOPASSWD:\s*ALL\s*$', result.stdout, re.MULTILINE) is not None
+
+HOST_FACTS = {
+    'os': _probe_os,
+    'root': _probe_root,
+}
+
+_host_facts = None
+
+def host_fact(name, *, refresh=False):
+    """Returns a fact about this machine which doesn't change until the next reboot.
+
+    Facts are probed on first use and then cached in memory as well as in the syncbin cache directory, so subsequent processes don't have to probe again. Pass refresh=True after changing the fact, e.g. after configuring sudo.
+    """
+    global _host_facts
+
+    if _host_facts is None:
+        import getpass
+
+        key = {'bootID': boot_id(), 'user': getpass.getuser()}
+        _host_facts = load_cache('host-facts.json', default={})
+        if _host_facts.get('key') != key:
+            _host_facts = {'key': key, 'facts': {}}
+    if refresh or name not in _host_facts['facts']:
+        _host_facts['facts'][name] = HOST_FACTS[name]()
+        save_cache('host-facts.json', _host_facts)
+    return _host_facts['facts'][name]
+
+def get_os():
+    return host_fact('os')
+
+def lock(lock_name, *, shared=False, timeout=None):
+    """Returns a context manager holding the named lock. See `syncbin_lock.Lock` for details."""
+    import syncbin_lock
+
+    return syncbin_lock.Lock(lock_name, shared=shared, timeout=timeout)
 
 def py_dir():
+    import pathlib
+
     return pathlib.Path('/opt/py' if root() else '{}/py'.format(os.environ['HOME']))
 
 def pypi_import(name, package=None):
-    # just try importing the module first, in case it's already installed
-    with contextlib.suppress(ImportError):
-        return importlib.import_module(name)
-    # import failed, try installing the package
-    if package is None:
-        package = name
-    with contextlib.suppress(ImportError): # Debian doesn't have ensurepip but does have pip
-        import ensurepip
-        ensurepip.bootstrap(upgrade=True, user=True)
-    subprocess.run([sys.executable or 'python3', '-m', 'pip', 'install' , '--quiet', '--user', package], check=True)
-    return importlib.import_module(name)
+    return pypi_imports(name if package is None else (name, package))[0]
+
+def pypi_imports(*modules):
+    """Imports the given modules, installing any which are missing from PyPI using a single pip invocation.
+
+    Each argument is either a module name, or a (module name, PyPI package name) pair if the two differ. Returns the modules in the same order.
+
+    Modules which have been imported successfully before are remembered in the syncbin cache directory, so they're imported directly without checking first.
+    """
+    import importlib
+    import importlib.util
+
+    modules = [(module, module) if isinstance(module, str) else module for module in modules]
+    stamp = load_cache('pypi-imports.json', default={})
+    known = set(stamp.get(sys.executable, []))
+    if not all(name in known for name, package in modules):
+        missing = [package for name, package in modules if name not in known and importlib.util.find_spec(name) is None]
+        if missing:
+            import site
+            import subprocess
+
+            if importlib.util.find_spec('pip') is None:
+                try:
+                    import ensurepip
+                except ImportError:
+                    pass # Debian doesn't have ensurepip but does have pip
+                else:
+                    ensurepip.bootstrap(upgrade=True, user=True)
+            subprocess.run([sys.executable or 'python3', '-m', 'pip', 'install', '--quiet', '--user', *sorted(set(missing))], check=True)
+            # the user site directory is only added to sys.path at startup if it already existed
+            user_site = site.getusersitepackages()
+            if user_site not in sys.path:
+                site.addsitedir(user_site)
+            importlib.invalidate_caches()
+    try:
+        result = [importlib.import_module(name) for name, package in modules]
+    except ImportError:
+        if not known:
+            raise
+        # a remembered module has been uninstalled since, check again
+        stamp.pop(sys.executable, None)
+        save_cache('pypi-imports.json', stamp)
+        return pypi_imports(*modules)
+    if not known.issuperset(name for name, package in modules):
+        stamp[sys.executable] = sorted(known | {name for name, package in modules})
+        save_cache('pypi-imports.json', stamp)
+    return result
+
+def python_requirements():
+    """Returns the Python modules syncbin requires, as a dict mapping module names to the names of the packages providing them."""
+    requirements = {}
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'config', 'python-requirements.txt')) as requirements_file:
+        for line in requirements_file:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                module, *package = line.split()
+                requirements[module] = package[0] if package else module
+    return requirements
 
 def root():
-    if getpass.getuser() == 'root':
-        return True
-    return subprocess.run(['sudo', '-n', 'true'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+    return host_fact('root')
 
 def version():
+    # the checkout containing this file is the syncbin install, so there's no need to look up the gitdir
+    try:
+        with open(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'version.txt')) as version_file:
+            return version_file.read().strip()
+    except OSError:
+        pass
     try:
         with (git_dir() / 'github.com' / 'fenhl' / 'syncbin' / 'master' / 'version.txt').open() as version_file:
             return version_file.read().strip()
@@ -150,473 +332,102 @@ def yesno(question):
         'no': False
     }[choose(question, [('y', 'yes'), ('n', 'no')])]
 
-__version__ = version()
-
-def bootstrap_setup(setup_name):
-    def inner_wrapper(f):
-        def test_installed(is_installed):
-            f.is_installed = is_installed
-            return f
-        def requires(*reqs):
-            f.requirements += reqs
-            return f
-
-        BOOTSTRAP_SETUPS[setup_name] = f
-        f.is_installed = lambda: None
-        f.test_installed = test_installed
-        f.requirements = []
-        f.requires = requires
-        f.apt_packages = set()
-        f.dist_apt_packages = {}
-        return f
-    return inner_wrapper
-
-@bootstrap_setup('brew')
-def bootstrap_brew():
-    """Installs various utilities for macOS using Homebrew"""
-    try:
-        subprocess.run(['brew', 'install', 'git', 'jq', 'libheif', 'ruby', 'terminal-notifier'], check=True)
-    except subprocess.CalledProcessError:
-        subprocess.run(['brew', 'link', '--overwrite', 'ruby'], check=True)
-    subprocess.run(['brew', 'cask', 'install', 'bartender', 'bitbar', 'discord', 'firefox', 'qlmarkdown'], check=True)
-
-@bootstrap_brew.test_installed
-def bootstrap_brew():
-    if shutil.which('brew') is None:
-        return False
-    return len(json.loads(subprocess.run(['brew', 'info', '--json=v1', 'terminal-notifier'], stdout=subprocess.PIPE, encoding='utf-8', check=True).stdout)[0]['installed']) > 0
-
-@bootstrap_setup('debian-root')
-def bootstrap_debian_root():
-    """Essential setup for Debian systems with root access"""
-    if getpass.getuser() == 'root':
-        subprocess.run(['chmod', 'u+s', shutil.which('ping')], check=True)
-    else:
-        subprocess.run(['sudo', 'chmod', 'u+s', shutil.which('ping')], check=True)
-
-bootstrap_debian_root.apt_packages = {
-    'cmark', # for md
-    'exiftool',
-    'htop',
-    'jq',
-    'needrestart',
-    'ntp',
-    'ruby',
-    'ruby-dev',
-    'screen',
-    'ssmtp', #TODO configure
-    'unattended-upgrades', #TODO configure (unattended-upgrades config, call night-device-report)
-}
-
-# exa not available on Ubuntu for some reason
-bootstrap_debian_root.dist_apt_packages['Debian'] = {'exa'}
-bootstrap_debian_root.dist_apt_packages['Raspbian'] = {'exa'}
-
-@bootstrap_debian_root.test_installed
-def bootstrap_debian_root():
-    if getpass.getuser() == 'root':
-        try:
-            subprocess.run(['systemctl', '-q', 'is-active', 'ntp'], stderr=subprocess.DEVNULL, check=True)
-        except (FileNotFoundError, subprocess.CalledProcessError):
-            return False
-        else:
-            return True
-    else:
-        # make sure sudo and systemctl work
-        try:
-            subprocess.run(['sudo', '-n', 'systemctl'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
-        except:
-            return None
-        # check if ntp (installed by this setup) is running
-        try:
-            subprocess.run(['sudo', '-n', 'systemctl', '-q', 'is-active', 'ntp'], stderr=subprocess.DEVNULL, check=True)
-        except subprocess.CalledProcessError:
-            return False
-        else:
-            return True
-
-@bootstrap_setup('finder')
-def bootstrap_finder():
-    """Configure useful defaults for Finder on macOS"""
-    print('[....] configuring Finder', end='\r', flush=True)
-    subprocess.run(['launchctl', 'unload', '-w', '/System/Library/LaunchAgents/com.apple.rcd.plist'], check=True) #FROM https://www.howtogeek.com/274345/stop-itunes-from-launching-when-you-press-play-on-your-macs-keyboard/ # seems to work with SIP enabled now
-    subprocess.run(['defaults', 'write', '-g', 'NSScrollViewRubberbanding', '-int', '0'], check=True)
-    subprocess.run(['defaults', 'write', 'com.apple.finder', 'AppleShowAllFiles', '-bool', 'true'], check=True)
-    subprocess.run(['defaults', 'write', 'com.apple.finder', '_FXShowPosixPathInTitle', '-bool', 'true'], check=True)
-    print('[ ok ]')
-    print('[....] restarting Finder', end='\r', flush=True)
-    subprocess.run(['killall', 'Finder'], check=True)
-    print('[ ok ]')
-    print('[....] configuring Dock', end='\r', flush=True)
-    subprocess.run(['defaults', 'write', 'com.apple.Dock', 'showhidden', '-bool', 'true'], check=True)
-    print('[ ok ]')
-    print('[....] restarting Dock', end='\r', flush=True)
-    subprocess.run(['killall', 'Dock'], check=True)
-    print('[ ok ]')
-
-@bootstrap_finder.test_installed
-def bootstrap_finder():
-    try:
-        #TODO check if Play key has been fixed
-        return subprocess.run(['defaults', 'read', 'com.apple.finder', '_FXShowPosixPathInTitle'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True).stdout == b'1\n'
-    except FileNotFoundError:
-        return None
-    except subprocess.CalledProcessError:
-        return False
-
-@bootstrap_setup('gitdir')
-def bootstrap_gitdir():
-    """Installs `gitdir` and configures `git`. Requires the `python` setup."""
-    subprocess.run(['git', 'config', '--global', 'merge.conflictstyle', 'diff3'], check=True)
-    subprocess.run(['git', 'config', '--global', 'pull.ff', 'only'], check=True)
-    subprocess.run([sys.executable or 'python3', '-m', 'pip', 'install' , '--quiet', '--user', 'PyGithub'], check=True) # dependency of gitdir.host.github
-    gitdir_gitdir = git_dir(existing_only=False) / 'github.com' / 'fenhl' / 'gitdir'
-    if not gitdir_gitdir.exists():
-        gitdir_gitdir.mkdir(parents=True)
-    if not (gitdir_gitdir / 'master').exists():
-        subprocess.run(['git', 'clone', 'https://github.com/fenhl/gitdir.git', 'master'], cwd=str(git_dir() / 'github.com' / 'fenhl' / 'gitdir'), check=True)
-    if not py_dir().exists():
-        try:
-            py_dir().mkdir()
-        except PermissionError:
-            subprocess.run(['sudo', 'mkdir', str(py_dir())], check=True)
-    if not (py_dir() / 'gitdir').exists():
-        try:
-            (py_dir() / 'gitdir').symlink_to(gitdir_gitdir / 'master' / 'gitdir')
-        except PermissionError:
-            subprocess.run(['sudo', 'ln', '-s', str(gitdir_gitdir / 'master' / 'gitdir'), str(py_dir() / 'gitdir')], check=True)
+if __name__ == '__main__':
+    import shutil
+    import subprocess
 
-@bootstrap_gitdir.test_installed
-def bootstrap_gitdir():
     try:
-        sys.path.append(str(py_dir()))
-        import gitdir
+        from docopt import docopt
     except ImportError:
-        return False
+        if sys.argv[1:2] in (['check-deps'], ['hasinet'], ['prompt-daemon'], ['rprompt'], ['startup']):
+            # these subcommands run on every login or prompt or are called by other scripts, so they have to work before docopt is installed
+            def option_value(name, default=None):
+                return next((arg[len(name) + 1:] for arg in sys.argv[2:] if arg.startswith(f'{name}=')), default)
+
+            arguments = {
+                **dict.fromkeys(['bootstrap', 'check-deps', 'has-cronjob', 'hasinet', 'install', 'lock-stats', 'prompt-bench', 'prompt-daemon', 'rprompt', 'startup'], False),
+                sys.argv[1]: True,
+                '--bench': '--bench' in sys.argv[2:],
+                '--deadline': option_value('--deadline', '0.3'),
+                '--ignore-lock': '--ignore-lock' in sys.argv[2:],
+                '--json': '--json' in sys.argv[2:],
+                '--no-internet-test': '--no-internet-test' in sys.argv[2:],
+                '--refresh': '--refresh' in sys.argv[2:],
+                '--runs': option_value('--runs', '10'),
+                '--target': option_value('--target'),
+                '--trace': option_value('--trace'),
+            }
+        else:
+            print('[ !! ] docopt not installed, defaulting to `syncbin bootstrap python`', file=sys.stderr)
+            arguments = {
+                'bootstrap': True,
+                '<setup>': ['python'],
+            }
     else:
-        return True
+        arguments = docopt(__doc__, version='fenhl/syncbin {}'.format(version()))
+    if arguments['bootstrap']:
+        import syncbin_bootstrap
 
-@bootstrap_setup('keylayout')
-def bootstrap_keylayout():
-    if get_os() == 'macOS':
-        repo = gitdir.host.by_name('github.com').repo('fenhl/german-and-wanya-for-apple-international-english.keylayout')
-        repo.clone()
-        if getpass.getuser() == 'root':
-            shutil.copy(repo.branch_path() / 'German and Wanya for Apple International English.keylayout', '/Library/Keyboard Layouts')
+        if len(arguments['<setup>']) == 0:
+            syncbin_bootstrap.bootstrap_help(refresh=arguments['--refresh'])
         else:
-            subprocess.run(['sudo', 'cp', repo.branch_path() / 'German and Wanya for Apple International English.keylayout', '/Library/Keyboard Layouts'], check=True)
-    else:
-        raise NotImplementedError(f"Don't know how to install the keyboard layout for {get_os()}")
-
-bootstrap_keylayout.requires('gitdir')
-
-@bootstrap_setup('macbook')
-def bootstrap_macbook():
-    """Installs `batcharge` for MacBooks."""
-    bin_path = (pathlib.Path.home() / 'bin')
-    if not bin_path.exists():
-        bin_path.mkdir()
-    batcharge = bin_path / 'batcharge'
-    batcharge.symlink_to(git_dir() / 'fenhl.net' / 'syncbin-private' / 'master' / 'bin' / 'batcharge-macbook')
-
-bootstrap_macbook.requires('syncbin-private')
-
-@bootstrap_macbook.test_installed
-def bootstrap_macbook():
-    config_path = (pathlib.Path.home() / 'bin' / 'batcharge')
-    if not config_path.is_symlink():
-        return False
-    return config_path.resolve() == (git_dir() / 'fenhl.net' / 'syncbin-private' / 'master' / 'python' / 'batcharge_macbook.py').resolve()
-
-@bootstrap_setup('nginx')
-def bootstrap_nginx():
-    """Installs the nginx_ensite utility"""
-    try:
-        sys.path.append(str(py_dir()))
-        import gitdir.host
-    except ImportError:
-        print('[ ** ] run `syncbin bootstrap gitdir`, then re-run `syncbin bootstrap nginx` to install packages from github')
-    else:
-        gitdir.host.by_name('github.com').clone('perusio/nginx_ensite')
-        subprocess.run(['sudo', 'make', 'install'], cwd=str(gitdir.host.by_name('github.com').repo('perusio/nginx_ensite').branch_path()))
-
-bootstrap_nginx.requires('gitdir')
-
-@bootstrap_nginx.test_installed
-def bootstrap_nginx():
-    return shutil.which('nginx_ensite') is not None
-
-@bootstrap_setup('no-battery')
-def bootstrap_no_battery():
-    """Installs `batcharge` for devices without batteries."""
-    bin_path = (pathlib.Path.home() / 'bin')
-    if not bin_path.exists():
-        bin_path.mkdir()
-    batcharge = bin_path / 'batcharge'
-    with batcharge.open('w') as f:
-        print('#!/bin/sh\n\nexit 0', file=f)
-    batcharge.chmod(batcharge.stat().st_mode | stat.S_IEXEC)
-
-@bootstrap_no_battery.test_installed
-def bootstrap_no_battery():
-    if not (pathlib.Path.home() / 'bin' / 'batcharge').exists():
-        return False
-    with (pathlib.Path.home() / 'bin' / 'batcharge').open() as batcharge_f:
-        return batcharge_f.read() == '#!/bin/sh\n\nexit 0\n'
-
-@bootstrap_setup('python')
-def bootstrap_python():
-    """Creates `/opt/py` and links Python modules."""
-    try:
-        sys.path.append(str(py_dir()))
-        import gitdir.host
-    except ImportError:
-        print('[ ** ] run `syncbin bootstrap gitdir`, then re-run `syncbin bootstrap python` to install packages from github')
-    else:
-        gitdir.host.by_name('github.com').clone('fenhl/python-xdg-basedir')
-        gitdir.host.by_name('github.com').clone('fenhl/python-class-key')
-        gitdir.host.by_name('github.com').clone('fenhl/fancyio')
-        gitdir.host.by_name('github.com').clone('fenhl/lazyjson')
-        gitdir.host.by_name('github.com').clone('fenhl/python-timespec')
-        if root() and getpass.getuser() != 'root':
-            if not (py_dir() / 'basedir.py').exists():
-                subprocess.run(['sudo', 'ln', '-s', str(git_dir() / 'github.com' / 'fenhl' / 'python-xdg-basedir' / 'master' / 'basedir'), str(py_dir() / 'basedir')], check=True)
-            if not (py_dir() / 'class_key.py').exists():
-                subprocess.run(['sudo', 'ln', '-s', str(git_dir() / 'github.com' / 'fenhl' / 'python-class-key' / 'master' / 'class_key.py'), str(py_dir() / 'class_key.py')], check=True)
-            if not (py_dir() / 'fancyio.py').exists():
-                subprocess.run(['sudo', 'ln', '-s', str(git_dir() / 'github.com' / 'fenhl' / 'fancyio' / 'master' / 'fancyio.py'), str(py_dir() / 'fancyio.py')], check=True)
-            if not (py_dir() / 'lazyjson.py').exists():
-                subprocess.run(['sudo', 'ln', '-s', str(git_dir() / 'github.com' / 'fenhl' / 'lazyjson' / 'master' / 'lazyjson'), str(py_dir() / 'lazyjson')], check=True)
-            if not (py_dir() / 'timespec').exists():
-                subprocess.run(['sudo', 'ln', '-s', str(git_dir() / 'github.com' / 'fenhl' / 'python-timespec' / 'master' / 'timespec'), str(py_dir() / 'timespec')], check=True)
+            syncbin_bootstrap.bootstrap(*arguments['<setup>'])
+    elif arguments['check-deps']:
+        deps = check_deps(refresh=arguments['--refresh'])
+        if arguments['--json']:
+            import json
+
+            json.dump(deps, sys.stdout, indent=4, sort_keys=True)
+            print()
         else:
-            if not (py_dir() / 'basedir.py').exists():
-                (py_dir() / 'basedir').symlink_to(git_dir() / 'github.com' / 'fenhl' / 'python-xdg-basedir' / 'master' / 'basedir')
-            if not (py_dir() / 'basedir.py').exists():
-                (py_dir() / 'class_key.py').symlink_to(git_dir() / 'github.com' / 'fenhl' / 'python-class-key' / 'master' / 'class_key.py')
-            if not (py_dir() / 'fancyio.py').exists():
-                (py_dir() / 'fancyio.py').symlink_to(git_dir() / 'github.com' / 'fenhl' / 'fancyio' / 'master' / 'fancyio.py')
-            if not (py_dir() / 'lazyjson.py').exists():
-                (py_dir() / 'lazyjson').symlink_to(git_dir() / 'github.com' / 'fenhl' / 'lazyjson' / 'master' / 'lazyjson')
-            if not (py_dir() / 'timespec').exists():
-                (py_dir() / 'timespec').symlink_to(git_dir() / 'github.com' / 'fenhl' / 'python-timespec' / 'master' / 'timespec')
-
-bootstrap_python.requires('gitdir')
-
-@bootstrap_python.test_installed
-def bootstrap_python():
-    try:
-        sys.path.append(str(py_dir()))
-        import basedir, fancyio, lazyjson, timespec
-    except ImportError:
-        return False
-    else:
-        return True
+            for module, status in deps.items():
+                if not status['found']:
+                    print(status['package'])
+        sys.exit(0 if all(status['found'] for status in deps.values()) else 1)
+    elif arguments['has-cronjob']:
+        import syncbin_cron
+
+        cronjobs = syncbin_cron.has_cronjob(*arguments['<pattern>'], refresh=arguments['--refresh'])
+        for pattern, crontab_name in cronjobs.items():
+            print(crontab_name or 'none')
+        sys.exit(0 if all(cronjobs.values()) else 1)
+    elif arguments['hasinet']:
+        import syncbin_hasinet
 
-@bootstrap_setup('rust')
-def bootstrap_rust():
-    """Installs Rust via `rustup`."""
-    import basedir
-
-    #TODO install Rust via apt-get if on Debian ≥12 (bookworm), which has a version of Cargo supporting the rust-version package field
-    subprocess.run('curl --proto \'=https\' --tlsv1.2 -sSf https://sh.rustup.rs | sh -s -- --no-modify-path -y', shell=True, check=True)
-    crates = {'cargo-limit', 'cargo-update'}
-    if shutil.which('exa') is None:
-        crates.add('exa')
-    git_crates = {
-        'https://github.com/holmgr/cargo-sweep': ('master', ['cargo-sweep']), # waiting for a release with f24188b
-        'https://github.com/fenhl/diskspace': ('main', []),
-    }
-    subprocess.run(['cargo', 'install'] + sorted(crates), check=True)
-    for repo_url, (branch, binaries) in git_crates.items():
-        subprocess.run(['cargo', 'install', f'--git={repo_url}'] + ([] if branch is None else [f'--branch={branch}']) + binaries, check=True)
-    if (git_dir() / 'fenhl.net' / 'dev' / 'master').exists():
-        subprocess.run(['cargo', 'build', '--release'], cwd=git_dir() / 'fenhl.net' / 'dev' / 'master', check=True) #TODO include in rust all-projects
-        basedir.config_dirs('fenhl/syncbin.json').lazy_json(writeable_only=True, default={'rust': {'projects': []}}, init=True)['rust']['projects'].append('/opt/git/fenhl.net/dev/master')
-
-bootstrap_rust.apt_packages = {
-    'curl',
-    'libdbus-1-3', # for diskspace
-    'libdbus-1-dev', # for diskspace
-    'libssl-dev',
-    'pkg-config',  # for diskspace
-}
+        sys.exit(0 if syncbin_hasinet.has_internet(arguments['--target'], refresh=arguments['--refresh']) else 1)
+    elif arguments['install']:
+        sys.exit(subprocess.run(['sh', str(git_dir() / 'github.com' / 'fenhl' / 'syncbin' / 'master' / 'config' / 'install.sh')]).returncode)
+    elif arguments['lock-stats']:
+        import syncbin_lock
 
-@bootstrap_rust.test_installed
-def bootstrap_rust():
-    return shutil.which('rustup') is not None
-
-@bootstrap_setup('ssh')
-def bootstrap_ssh():
-    """Copies the `syncbin` SSH config file, generates a public key if none exists, and optionally copies it onto vendredi."""
-    config_path = (pathlib.Path.home() / '.ssh' / 'config')
-    shutil.copy2(str(git_dir() / 'github.com' / 'fenhl' / 'syncbin' / 'master' / 'config' / 'ssh'), str(config_path))
-    config_path.chmod(0o600) # http://serverfault.com/a/253314
-    if platform.system() == 'Darwin' and shutil.which('ssh-copy-id') is None:
-        subprocess.run(['brew', 'install', 'ssh-copy-id'], check=True)
-    with open('/dev/zero', 'rb') as dev_zero:
-        subprocess.run(['ssh-keygen', '-q', '-N', ''], stdin=dev_zero, stdout=subprocess.DEVNULL, check=True)
-    if yesno('copy SSH pubkey onto vendredi?'):
-        subprocess.run(['ssh-copy-id', 'vendredi'], check=True)
-
-@bootstrap_ssh.test_installed
-def bootstrap_ssh():
-    config_path = (pathlib.Path.home() / '.ssh' / 'config')
-    return subprocess.run(['diff', str(config_path), str(git_dir() / 'github.com' / 'fenhl' / 'syncbin' / 'master' / 'config' / 'ssh')], stdout=subprocess.DEVNULL).returncode == 0
-
-@bootstrap_setup('sudo')
-def bootstrap_sudo():
-    """Configures passwordless `sudo`."""
-    sudoers_d = pathlib.Path('/etc/sudoers.d')
-    if not sudoers_d.exists():
-        subprocess.run(['sudo', 'mkdir', '-p', str(sudoers_d)], check=True)
-    print('[ ** ] For passwordless login, insert the following line into the opened document:')
-    print('fenhl ALL=(ALL) NOPASSWD: ALL')
-    input('[ ?? ] Press return to continue')
-    subprocess.run(['sudo', 'nano', str(sudoers_d / 'fenhl')], check=True)
-
-@bootstrap_sudo.test_installed
-def bootstrap_sudo():
-    return subprocess.run(['sudo', '-n', 'true'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0 #TODO remove false positive due to sudo mode, remove false negative due to Touch ID
-
-@bootstrap_setup('syncbin-private')
-def bootstrap_syncbin_private():
-    """Installs the private `syncbin` extensions."""
-    sys.path.append(str(py_dir()))
-    import gitdir.host
+        syncbin_lock.print_lock_stats()
+    elif arguments['prompt-bench']:
+        import syncbin_prompt
 
-    try:
-        gitdir.host.by_name('fenhl.net').clone('dev')
-        if shutil.which('cargo') is not None:
-            subprocess.run(['cargo', 'build', '--release'], cwd=git_dir() / 'fenhl.net' / 'dev' / 'master', check=True)
-        gitdir.host.by_name('fenhl.net').clone('syncbin-private')
-    except PermissionError:
-        sys.exit('[!!!!] Permission denied. Fix /opt/git permissions, then try again.')
+        sys.exit(0 if syncbin_prompt.bench(arguments['<segment>'], runs=int(arguments['--runs'])) else 1)
+    elif arguments['prompt-daemon']:
+        import syncbin_prompt
 
-bootstrap_syncbin_private.requires('gitdir')
+        syncbin_prompt.run_daemon()
+    elif arguments['rprompt']:
+        import syncbin_prompt
 
-@bootstrap_syncbin_private.test_installed
-def bootstrap_syncbin_private():
-    try:
-        import syncbin_private
-    except ImportError:
-        return False
-    else:
-        return True
+        if arguments['--bench']:
+            syncbin_prompt.bench_rprompt(runs=int(arguments['--runs']))
+        else:
+            syncbin_prompt.render_once(deadline=float(arguments['--deadline']))
+    elif arguments['startup']:
+        import syncbin_startup
 
-@bootstrap_setup('t')
-def bootstrap_t():
-    """Installs the Twitter CLI `t`."""
-    import gitdir.host
+        sys.exit(syncbin_startup.run_startup(ignore_lock=arguments['--ignore-lock'], internet_test=not arguments['--no-internet-test'], trace_path=arguments['--trace']))
+    elif arguments['startup-report']:
+        import syncbin_startup
 
-    try:
-        gitdir.host.by_name('github.com').clone('sferik/t')
-    except PermissionError:
-        sys.exit('[!!!!] Permission denied. Fix /opt/git permissions, then try again.')
-    if root() and getpass.getuser() != 'root':
-        subprocess.run(['sudo', 'gem', 'install', 't'], check=True)
-    else:
-        subprocess.run(['gem', 'install', 't'], check=True)
-    subprocess.run(['t', 'authorize', '--display-uri'], check=True)
-
-@bootstrap_t.test_installed
-def bootstrap_t():
-    return shutil.which('t') is not None
-
-@bootstrap_setup('zsh')
-def bootstrap_zsh():
-    """Installs useful extensions for Zsh."""
-    sys.path.append(str(py_dir()))
-    import gitdir.host
-
-    gitdir.host.by_name('github.com').clone('zsh-users/zsh-syntax-highlighting')
-    gitdir.host.by_name('github.com').clone('robbyrussell/oh-my-zsh')
-    if platform.system() == 'Darwin' and shutil.which('zsh') == '/bin/zsh':
-        # macOS but Homebrew Zsh not installed
-        if yesno('install newer Zsh version using Homebrew?'):
-            subprocess.run(['brew', 'install', 'zsh'], check=True)
-            needs_append = True
-            with open('/etc/shells') as shells:
-                for line in shells:
-                    if line.strip() == '/usr/local/bin/zsh':
-                        needs_append = False
-                        break
-            if needs_append:
-                subprocess.run(['sudo', 'tee', '-a', '/etc/shells'], input=b'/usr/local/bin/zsh\n', stdout=subprocess.DEVNULL, check=True)
-            print('[ ** ] Added to /etc/shells. You can now `chsh -s /usr/local/bin/zsh` and relog.')
-
-bootstrap_zsh.requires('gitdir')
-
-@bootstrap_zsh.test_installed
-def bootstrap_zsh():
-    return (git_dir() / 'github.com' / 'zsh-users' / 'zsh-syntax-highlighting' / 'master').is_dir()
-
-if bootstrap_syncbin_private.is_installed():
-    import syncbin_private
-
-    if hasattr(syncbin_private, 'update_bootstrap_setups'):
-        syncbin_private.update_bootstrap_setups(BOOTSTRAP_SETUPS)
-
-def bootstrap(*setups):
-    apt_packages = set()
-    for setup_name in setups:
-        apt_packages |= BOOTSTRAP_SETUPS[setup_name].dist_apt_packages.get(get_os(), set())
-        if get_os() in ('Debian', 'Raspbian', 'Ubuntu'):
-            apt_packages |= BOOTSTRAP_SETUPS[setup_name].apt_packages
-    if apt_packages:
-        subprocess.run(([] if getpass.getuser() == 'root' else ['sudo']) + ['apt-get', 'install', '-y'] + sorted(apt_packages), check=True)
-    for setup_name in setups:
-        if setup_name not in BOOTSTRAP_SETUPS:
-            print('[!!!!] Unknown setup for `syncbin bootstrap`: {!r}'.format(setup_name), file=sys.stderr)
-            bootstrap_help(file=sys.stderr)
-            sys.exit(1)
-    for setup_name in setups:
-        #TODO check requirements
-        BOOTSTRAP_SETUPS[setup_name]()
-
-def bootstrap_help(file=sys.stdout):
-    print('[ ** ] Available setups:', file=file)
-    setups = sorted(BOOTSTRAP_SETUPS.items())
-    max_len = max(len(name) for name, setup in setups)
-    for name, setup in setups:
-        try:
-            blessings = pypi_import('blessings')
-
-            term = blessings.Terminal()
-        except Exception:
-            status_sigil = {
-                True: '✓',
-                False: '✗',
-                None: '?',
-            }[setup.is_installed()]
-        else:
-            status_sigil = {
-                True: term.bright_green('✓'),
-                False: term.bright_red('✗'),
-                None: term.bright_yellow('?'),
-            }[setup.is_installed()]
-        print('{} {}{}  {}'.format(status_sigil, name, ' ' * (max_len - len(name)), '(undocumented)' if setup.__doc__ is None else setup.__doc__), file=file)
-        #TODO more details
+        syncbin_startup.startup_report(last=int(arguments['--last']))
+    elif arguments['update'] and arguments['--all']:
+        import syncbin_update
 
-if __name__ == '__main__':
-    try:
-        arguments = docopt(__doc__, version='fenhl/syncbin {}'.format(version()))
-    except NameError:
-        arguments = {
-            'bootstrap': True,
-            '<setup>': ['python'],
-        }
-    if arguments['bootstrap']:
-        if len(arguments['<setup>']) == 0:
-            bootstrap_help()
-        else:
-            bootstrap(*arguments['<setup>'])
-    elif arguments['hasinet']:
-        sys.exit(subprocess.run(['syncbin-hasinet']).returncode)
-    elif arguments['install']:
-        sys.exit(subprocess.run(['sh', str(git_dir() / 'github.com' / 'fenhl' / 'syncbin' / 'master' / 'config' / 'install.sh')]).returncode)
-    elif arguments['startup']:
-        sys.exit(subprocess.run(['syncbin-startup'] + (['--ignore-lock'] if arguments['--ignore-lock'] else []) + (['--no-internet-test'] if arguments['--no-internet-test'] else [])).returncode)
+        sys.exit(syncbin_update.update_all(jobs=int(arguments['--jobs']), timeout=float(arguments['--timeout'])))
     elif arguments['update']:
         mode = None
         if arguments['public']:
@@ -0,0 +1,685 @@
+"""Bootstrap setups for `syncbin bootstrap`.
+
+This is kept separate from the `syncbin` module so that tools which only need `syncbin.__version__` don't pay for building the registry.
+"""
+
+import sys
+
+import concurrent.futures
+import contextlib
+import getpass
+import json
+import os
+import pathlib
+import platform
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+import syncbin
+import syncbin_sync
+from syncbin import get_os, git_dir, host_fact, py_dir, pypi_import, root, yesno
+
+BOOTSTRAP_SETUPS = {}
+# setups using the same resource never run at the same time. Resources are held using these syncbin locks, so the apt and brew locks are shared with `syncbin-startup`.
+RESOURCE_LOCKS = {
+    'apt': 'debian',
+    'brew': 'ruby',
+    'sudo': 'bootstrap-sudo', # may prompt for a password
+    'tty': 'bootstrap-tty', # prompts for input
+}
+_forget_status_lock = threading.Lock()
+PROBE_TIMEOUT = 10 # seconds, for the is_installed probes in `syncbin bootstrap` without arguments
+
+def bootstrap_setup(setup_name, *, files=(), binaries=(), ttl=None):
+    """Registers a setup for `syncbin bootstrap`.
+
+    The result of the setup's is_installed probe is cached until one of the given inputs changes: the mtime of any of the files (paths, or functions returning paths, which may also be directories or symlinks), the location or mtime of any of the binaries on the PATH, or ttl seconds passing. Setups without any inputs are probed every time.
+    """
+    def inner_wrapper(f):
+        def test_installed(is_installed):
+            f.is_installed = is_installed
+            return f
+        def requires(*reqs):
+            f.requirements += reqs
+            return f
+        def uses(*resources):
+            f.resources |= set(resources)
+            return f
+
+        BOOTSTRAP_SETUPS[setup_name] = f
+        f.is_installed = lambda: None
+        f.test_installed = test_installed
+        f.requirements = []
+        f.requires = requires
+        f.resources = set()
+        f.uses = uses
+        f.apt_packages = set()
+        f.dist_apt_packages = {}
+        f.status_inputs = {
+            'files': list(files),
+            'binaries': list(binaries),
+            'ttl': ttl,
+        }
+        return f
+    return inner_wrapper
+
+def status_signature(setup):
+    """Returns a JSON-compatible value which changes whenever one of the setup's status inputs does, or None if the setup's status can't be cached."""
+    if not setup.status_inputs['files'] and not setup.status_inputs['binaries'] and setup.status_inputs['ttl'] is None:
+        return None
+    signature = []
+    for path in setup.status_inputs['files']:
+        try:
+            if callable(path):
+                path = path()
+            path = os.path.expanduser(path)
+        except Exception:
+            return None # e.g. no gitdir yet
+        try:
+            signature.append([str(path), os.lstat(path).st_mtime_ns])
+        except OSError:
+            signature.append([str(path), None])
+    for binary in setup.status_inputs['binaries']:
+        binary_path = shutil.which(binary)
+        try:
+            signature.append([binary, binary_path, None if binary_path is None else os.stat(binary_path).st_mtime_ns])
+        except OSError:
+            signature.append([binary, binary_path, None])
+    return signature
+
+def forget_status(*setup_names):
+    with _forget_status_lock:
+        statuses = syncbin.load_cache('bootstrap-status.json', default={})
+        for setup_name in setup_names:
+            statuses.pop(setup_name, None)
+        syncbin.save_cache('bootstrap-status.json', statuses)
+
+@bootstrap_setup('brew', binaries=['brew'], ttl=24 * 60 * 60)
+def bootstrap_brew():
+    """Installs various utilities for macOS using Homebrew"""
+    try:
+        subprocess.run(['brew', 'install', 'git', 'jq', 'libheif', 'ruby', 'terminal-notifier'], check=True)
+    except subprocess.CalledProcessError:
+        subprocess.run(['brew', 'link', '--overwrite', 'ruby'], check=True)
+    subprocess.run(['brew', 'cask', 'install', 'bartender', 'bitbar', 'discord', 'firefox', 'qlmarkdown'], check=True)
+
+bootstrap_brew.uses('brew')
+
+@bootstrap_brew.test_installed
+def bootstrap_brew():
+    if shutil.which('brew') is None:
+        return False
+    return len(json.loads(subprocess.run(['brew', 'info', '--json=v1', 'terminal-notifier'], stdout=subprocess.PIPE, encoding='utf-8', check=True).stdout)[0]['installed']) > 0
+
+@bootstrap_setup('debian-root', files=['/var/lib/dpkg/status'], binaries=['systemctl'], ttl=60 * 60)
+def bootstrap_debian_root():
+    """Essential setup for Debian systems with root access"""
+    if getpass.getuser() == 'root':
+        subprocess.run(['chmod', 'u+s', shutil.which('ping')], check=True)
+    else:
+        subprocess.run(['sudo', 'chmod', 'u+s', shutil.which('ping')], check=True)
+
+bootstrap_debian_root.apt_packages = {
+    'cmark', # for md
+    'exiftool',
+    'htop',
+    'jq',
+    'needrestart',
+    'ntp',
+    'ruby',
+    'ruby-dev',
+    'screen',
+    'ssmtp', #TODO configure
+    'unattended-upgrades', #TODO configure (unattended-upgrades config, call night-device-report)
+}
+
+# exa not available on Ubuntu for some reason
+bootstrap_debian_root.dist_apt_packages['Debian'] = {'exa'}
+bootstrap_debian_root.dist_apt_packages['Raspbian'] = {'exa'}
+
+bootstrap_debian_root.uses('sudo')
+
+@bootstrap_debian_root.test_installed
+def bootstrap_debian_root():
+    if getpass.getuser() == 'root':
+        try:
+            subprocess.run(['systemctl', '-q', 'is-active', 'ntp'], stderr=subprocess.DEVNULL, check=True)
+        except (FileNotFoundError, subprocess.CalledProcessError):
+            return False
+        else:
+            return True
+    else:
+        # make sure sudo and systemctl work
+        try:
+            subprocess.run(['sudo', '-n', 'systemctl'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        except:
+            return None
+        # check if ntp (installed by this setup) is running
+        try:
+            subprocess.run(['sudo', '-n', 'systemctl', '-q', 'is-active', 'ntp'], stderr=subprocess.DEVNULL, check=True)
+        except subprocess.CalledProcessError:
+            return False
+        else:
+            return True
+
+@bootstrap_setup('finder', files=['~/Library/Preferences/com.apple.finder.plist'], binaries=['defaults'])
+def bootstrap_finder():
+    """Configure useful defaults for Finder on macOS"""
+    print('[....] configuring Finder', end='\r', flush=True)
+    subprocess.run(['launchctl', 'unload', '-w', '/System/Library/LaunchAgents/com.apple.rcd.plist'], check=True) #FROM https://www.howtogeek.com/274345/stop-itunes-from-launching-when-you-press-play-on-your-macs-keyboard/ # seems to work with SIP enabled now
+    subprocess.run(['defaults', 'write', '-g', 'NSScrollViewRubberbanding', '-int', '0'], check=True)
+    subprocess.run(['defaults', 'write', 'com.apple.finder', 'AppleShowAllFiles', '-bool', 'true'], check=True)
+    subprocess.run(['defaults', 'write', 'com.apple.finder', '_FXShowPosixPathInTitle', '-bool', 'true'], check=True)
+    print('[ ok ]')
+    print('[....] restarting Finder', end='\r', flush=True)
+    subprocess.run(['killall', 'Finder'], check=True)
+    print('[ ok ]')
+    print('[....] configuring Dock', end='\r', flush=True)
+    subprocess.run(['defaults', 'write', 'com.apple.Dock', 'showhidden', '-bool', 'true'], check=True)
+    print('[ ok ]')
+    print('[....] restarting Dock', end='\r', flush=True)
+    subprocess.run(['killall', 'Dock'], check=True)
+    print('[ ok ]')
+
+@bootstrap_finder.test_installed
+def bootstrap_finder():
+    try:
+        #TODO check if Play key has been fixed
+        return subprocess.run(['defaults', 'read', 'com.apple.finder', '_FXShowPosixPathInTitle'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True).stdout == b'1\n'
+    except FileNotFoundError:
+        return None
+    except subprocess.CalledProcessError:
+        return False
+
+@bootstrap_setup('gitdir', files=[lambda: py_dir() / 'gitdir'])
+def bootstrap_gitdir():
+    """Installs `gitdir` and configures `git`. Requires the `python` setup."""
+    subprocess.run(['git', 'config', '--global', 'merge.conflictstyle', 'diff3'], check=True)
+    subprocess.run(['git', 'config', '--global', 'pull.ff', 'only'], check=True)
+    subprocess.run([sys.executable or 'python3', '-m', 'pip', 'install' , '--quiet', '--user', 'PyGithub'], check=True) # dependency of gitdir.host.github
+    gitdir_gitdir = git_dir(existing_only=False) / 'github.com' / 'fenhl' / 'gitdir'
+    if not gitdir_gitdir.exists():
+        gitdir_gitdir.mkdir(parents=True)
+    if not (gitdir_gitdir / 'master').exists():
+        subprocess.run(['git', 'clone', 'https://github.com/fenhl/gitdir.git', 'master'], cwd=str(git_dir() / 'github.com' / 'fenhl' / 'gitdir'), check=True)
+    if not py_dir().exists():
+        try:
+            py_dir().mkdir()
+        except PermissionError:
+            subprocess.run(['sudo', 'mkdir', str(py_dir())], check=True)
+    if not (py_dir() / 'gitdir').exists():
+        try:
+            (py_dir() / 'gitdir').symlink_to(gitdir_gitdir / 'master' / 'gitdir')
+        except PermissionError:
+            subprocess.run(['sudo', 'ln', '-s', str(gitdir_gitdir / 'master' / 'gitdir'), str(py_dir() / 'gitdir')], check=True)
+
+bootstrap_gitdir.uses('sudo')
+
+@bootstrap_gitdir.test_installed
+def bootstrap_gitdir():
+    try:
+        sys.path.append(str(py_dir()))
+        import gitdir
+    except ImportError:
+        return False
+    else:
+        return True
+
+@bootstrap_setup('keylayout')
+def bootstrap_keylayout():
+    if get_os() == 'macOS':
+        repo = gitdir.host.by_name('github.com').repo('fenhl/german-and-wanya-for-apple-international-english.keylayout')
+        repo.clone()
+        if getpass.getuser() == 'root':
+            shutil.copy(repo.branch_path() / 'German and Wanya for Apple International English.keylayout', '/Library/Keyboard Layouts')
+        else:
+            subprocess.run(['sudo', 'cp', repo.branch_path() / 'German and Wanya for Apple International English.keylayout', '/Library/Keyboard Layouts'], check=True)
+    else:
+        raise NotImplementedError(f"Don't know how to install the keyboard layout for {get_os()}")
+
+bootstrap_keylayout.requires('gitdir')
+bootstrap_keylayout.uses('sudo')
+
+@bootstrap_setup('macbook', files=['~/bin/batcharge'])
+def bootstrap_macbook():
+    """Installs `batcharge` for MacBooks."""
+    syncbin_sync.deploy(syncbin_sync.batcharge_macbook())
+
+bootstrap_macbook.requires('syncbin-private')
+
+@bootstrap_macbook.test_installed
+def bootstrap_macbook():
+    return syncbin_sync.is_current(syncbin_sync.batcharge_macbook())
+
+@bootstrap_setup('nginx', binaries=['nginx_ensite'])
+def bootstrap_nginx():
+    """Installs the nginx_ensite utility"""
+    try:
+        sys.path.append(str(py_dir()))
+        import gitdir.host
+    except ImportError:
+        print('[ ** ] run `syncbin bootstrap gitdir`, then re-run `syncbin bootstrap nginx` to install packages from github')
+    else:
+        gitdir.host.by_name('github.com').clone('perusio/nginx_ensite')
+        subprocess.run(['sudo', 'make', 'install'], cwd=str(gitdir.host.by_name('github.com').repo('perusio/nginx_ensite').branch_path()))
+
+bootstrap_nginx.requires('gitdir')
+bootstrap_nginx.uses('sudo')
+
+@bootstrap_nginx.test_installed
+def bootstrap_nginx():
+    return shutil.which('nginx_ensite') is not None
+
+@bootstrap_setup('no-battery', files=['~/bin/batcharge'])
+def bootstrap_no_battery():
+    """Installs `batcharge` for devices without batteries."""
+    syncbin_sync.deploy(syncbin_sync.batcharge_stub())
+
+@bootstrap_no_battery.test_installed
+def bootstrap_no_battery():
+    return syncbin_sync.is_current(syncbin_sync.batcharge_stub())
+
+@bootstrap_setup('python', files=[py_dir])
+def bootstrap_python():
+    """Creates `/opt/py` and links Python modules."""
+    try:
+        sys.path.append(str(py_dir()))
+        import gitdir.host
+    except ImportError:
+        print('[ ** ] run `syncbin bootstrap gitdir`, then re-run `syncbin bootstrap python` to install packages from github')
+    else:
+        gitdir.host.by_name('github.com').clone('fenhl/python-xdg-basedir')
+        gitdir.host.by_name('github.com').clone('fenhl/python-class-key')
+        gitdir.host.by_name('github.com').clone('fenhl/fancyio')
+        gitdir.host.by_name('github.com').clone('fenhl/lazyjson')
+        gitdir.host.by_name('github.com').clone('fenhl/python-timespec')
+        for deployment in syncbin_sync.python_links():
+            if deployment.target.exists() and not deployment.target.is_symlink():
+                continue # installed some other way
+            if not syncbin_sync.is_current(deployment):
+                syncbin_sync.deploy(deployment, interactive=True)
+
+bootstrap_python.requires('gitdir')
+bootstrap_python.uses('sudo')
+
+@bootstrap_python.test_installed
+def bootstrap_python():
+    try:
+        sys.path.append(str(py_dir()))
+        import basedir, fancyio, lazyjson, timespec
+    except ImportError:
+        return False
+    else:
+        return True
+
+@bootstrap_setup('rust', binaries=['rustup'])
+def bootstrap_rust():
+    """Installs Rust via `rustup`."""
+    import basedir
+
+    #TODO install Rust via apt-get if on Debian ≥12 (bookworm), which has a version of Cargo supporting the rust-version package field
+    subprocess.run('curl --proto \'=https\' --tlsv1.2 -sSf https://sh.rustup.rs | sh -s -- --no-modify-path -y', shell=True, check=True)
+    crates = {'cargo-limit', 'cargo-update'}
+    if shutil.which('exa') is None:
+        crates.add('exa')
+    git_crates = {
+        'https://github.com/holmgr/cargo-sweep': ('master', ['cargo-sweep']), # waiting for a release with f24188b
+        'https://github.com/fenhl/diskspace': ('main', []),
+    }
+    subprocess.run(['cargo', 'install'] + sorted(crates), check=True)
+    for repo_url, (branch, binaries) in git_crates.items():
+        subprocess.run(['cargo', 'install', f'--git={repo_url}'] + ([] if branch is None else [f'--branch={branch}']) + binaries, check=True)
+    if (git_dir() / 'fenhl.net' / 'dev' / 'master').exists():
+        subprocess.run(['cargo', 'build', '--release'], cwd=git_dir() / 'fenhl.net' / 'dev' / 'master', check=True) #TODO include in rust all-projects
+        basedir.config_dirs('fenhl/syncbin.json').lazy_json(writeable_only=True, default={'rust': {'projects': []}}, init=True)['rust']['projects'].append('/opt/git/fenhl.net/dev/master')
+
+bootstrap_rust.apt_packages = {
+    'curl',
+    'libdbus-1-3', # for diskspace
+    'libdbus-1-dev', # for diskspace
+    'libssl-dev',
+    'pkg-config',  # for diskspace
+}
+
+@bootstrap_rust.test_installed
+def bootstrap_rust():
+    return shutil.which('rustup') is not None
+
+@bootstrap_setup('ssh', files=['~/.ssh/config', lambda: git_dir() / 'github.com' / 'fenhl' / 'syncbin' / 'master' / 'config' / 'ssh'])
+def bootstrap_ssh():
+    """Copies the `syncbin` SSH config file, generates a public key if none exists, and optionally copies it onto vendredi."""
+    syncbin_sync.deploy(syncbin_sync.ssh_config())
+    if platform.system() == 'Darwin' and shutil.which('ssh-copy-id') is None:
+        subprocess.run(['brew', 'install', 'ssh-copy-id'], check=True)
+    with open('/dev/zero', 'rb') as dev_zero:
+        subprocess.run(['ssh-keygen', '-q', '-N', ''], stdin=dev_zero, stdout=subprocess.DEVNULL, check=True)
+    if yesno('copy SSH pubkey onto vendredi?'):
+        subprocess.run(['ssh-copy-id', 'vendredi'], check=True)
+
+bootstrap_ssh.uses('brew', 'tty')
+
+@bootstrap_ssh.test_installed
+def bootstrap_ssh():
+    return syncbin_sync.is_current(syncbin_sync.ssh_config())
+
+@bootstrap_setup('sudo', files=['/etc/sudoers', '/etc/sudoers.d'], ttl=60 * 60)
+def bootstrap_sudo():
+    """Configures passwordless `sudo`."""
+    sudoers_d = pathlib.Path('/etc/sudoers.d')
+    if not sudoers_d.exists():
+        subprocess.run(['sudo', 'mkdir', '-p', str(sudoers_d)], check=True)
+    print('[ ** ] For passwordless login, insert the following line into the opened document:')
+    print('fenhl ALL=(ALL) NOPASSWD: ALL')
+    input('[ ?? ] Press return to continue')
+    subprocess.run(['sudo', 'nano', str(sudoers_d / 'fenhl')], check=True)
+    host_fact('root', refresh=True)
+
+bootstrap_sudo.uses('sudo', 'tty')
+
+@bootstrap_sudo.test_installed
+def bootstrap_sudo():
+    return subprocess.run(['sudo', '-n', 'true'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0 #TODO remove false positive due to sudo mode, remove false negative due to Touch ID
+
+@bootstrap_setup('syncbin-private', files=[lambda: git_dir() / 'fenhl.net' / 'syncbin-private' / 'master'])
+def bootstrap_syncbin_private():
+    """Installs the private `syncbin` extensions."""
+    sys.path.append(str(py_dir()))
+    import gitdir.host
+
+    try:
+        gitdir.host.by_name('fenhl.net').clone('dev')
+        if shutil.which('cargo') is not None:
+            subprocess.run(['cargo', 'build', '--release'], cwd=git_dir() / 'fenhl.net' / 'dev' / 'master', check=True)
+        gitdir.host.by_name('fenhl.net').clone('syncbin-private')
+    except PermissionError:
+        sys.exit('[!!!!] Permission denied. Fix /opt/git permissions, then try again.')
+
+bootstrap_syncbin_private.requires('gitdir')
+
+@bootstrap_syncbin_private.test_installed
+def bootstrap_syncbin_private():
+    try:
+        import syncbin_private
+    except ImportError:
+        return False
+    else:
+        return True
+
+@bootstrap_setup('t', binaries=['t'])
+def bootstrap_t():
+    """Installs the Twitter CLI `t`."""
+    import gitdir.host
+
+    try:
+        gitdir.host.by_name('github.com').clone('sferik/t')
+    except PermissionError:
+        sys.exit('[!!!!] Permission denied. Fix /opt/git permissions, then try again.')
+    if root() and getpass.getuser() != 'root':
+        subprocess.run(['sudo', 'gem', 'install', 't'], check=True)
+    else:
+        subprocess.run(['gem', 'install', 't'], check=True)
+    subprocess.run(['t', 'authorize', '--display-uri'], check=True)
+
+bootstrap_t.uses('sudo', 'tty')
+
+@bootstrap_t.test_installed
+def bootstrap_t():
+    return shutil.which('t') is not None
+
+@bootstrap_setup('zsh', files=[lambda: git_dir() / 'github.com' / 'zsh-users' / 'zsh-syntax-highlighting' / 'master', '/etc/shells'])
+def bootstrap_zsh():
+    """Installs useful extensions for Zsh."""
+    sys.path.append(str(py_dir()))
+    import gitdir.host
+
+    gitdir.host.by_name('github.com').clone('zsh-users/zsh-syntax-highlighting')
+    gitdir.host.by_name('github.com').clone('robbyrussell/oh-my-zsh')
+    if platform.system() == 'Darwin' and shutil.which('zsh') == '/bin/zsh':
+        # macOS but Homebrew Zsh not installed
+        if yesno('install newer Zsh version using Homebrew?'):
+            subprocess.run(['brew', 'install', 'zsh'], check=True)
+            needs_append = True
+            with open('/etc/shells') as shells:
+                for line in shells:
+                    if line.strip() == '/usr/local/bin/zsh':
+                        needs_append = False
+                        break
+            if needs_append:
+                subprocess.run(['sudo', 'tee', '-a', '/etc/shells'], input=b'/usr/local/bin/zsh\n', stdout=subprocess.DEVNULL, check=True)
+            print('[ ** ] Added to /etc/shells. You can now `chsh -s /usr/local/bin/zsh` and relog.')
+
+bootstrap_zsh.requires('gitdir')
+bootstrap_zsh.uses('brew', 'sudo', 'tty')
+
+@bootstrap_zsh.test_installed
+def bootstrap_zsh():
+    return (git_dir() / 'github.com' / 'zsh-users' / 'zsh-syntax-highlighting' / 'master').is_dir()
+
+if bootstrap_syncbin_private.is_installed():
+    import syncbin_private
+
+    if hasattr(syncbin_private, 'update_bootstrap_setups'):
+        syncbin_private.update_bootstrap_setups(BOOTSTRAP_SETUPS)
+
+def bootstrap(*setups):
+    for setup_name in setups:
+        if setup_name not in BOOTSTRAP_SETUPS:
+            print('[!!!!] Unknown setup for `syncbin bootstrap`: {!r}'.format(setup_name), file=sys.stderr)
+            bootstrap_help(file=sys.stderr)
+            sys.exit(1)
+    plan = resolve_requirements(setups)
+    for setup_name in sorted(plan.keys() - set(setups)):
+        print('[ ** ] also running setup {!r}, required by {}'.format(setup_name, ', '.join(sorted(name for name, reqs in plan.items() if setup_name in reqs))))
+    apt_packages = set()
+    os_name = get_os()
+    for setup_name in plan:
+        apt_packages |= BOOTSTRAP_SETUPS[setup_name].dist_apt_packages.get(os_name, set())
+        if os_name in ('Debian', 'Raspbian', 'Ubuntu'):
+            apt_packages |= BOOTSTRAP_SETUPS[setup_name].apt_packages
+    if apt_packages:
+        with syncbin.lock(RESOURCE_LOCKS['apt']):
+            subprocess.run(([] if getpass.getuser() == 'root' else ['sudo']) + ['apt-get', 'install', '-y'] + sorted(apt_packages), check=True)
+    timings, failures = run_setups(plan)
+    print_timings(plan, timings)
+    if failures:
+        for setup_name, e in sorted(failures.items()):
+            if e is None:
+                print('[!!!!] setup {!r} skipped because a requirement failed'.format(setup_name), file=sys.stderr)
+            elif isinstance(e, SystemExit):
+                print('[!!!!] setup {!r} failed{}'.format(setup_name, '' if e.code is None else ': {}'.format(e.code)), file=sys.stderr)
+            else:
+                print('[!!!!] setup {!r} failed: {}'.format(setup_name, e), file=sys.stderr)
+        sys.exit(1)
+
+def resolve_requirements(setups):
+    """Returns the given setups plus any of their transitive requirements which aren't installed yet, as a dict mapping each setup name to the names of its requirements within the plan."""
+    closure = set()
+    stack = list(setups)
+    while stack:
+        setup_name = stack.pop()
+        if setup_name in closure:
+            continue
+        if setup_name not in BOOTSTRAP_SETUPS:
+            raise ValueError('Unknown setup required for `syncbin bootstrap`: {!r}'.format(setup_name))
+        closure.add(setup_name)
+        stack += BOOTSTRAP_SETUPS[setup_name].requirements
+    installed = dict(probe_installed((setup_name, BOOTSTRAP_SETUPS[setup_name]) for setup_name in closure - set(setups)))
+    plan = {}
+    visiting = set()
+
+    def visit(setup_name):
+        if setup_name in plan:
+            return
+        if setup_name in visiting:
+            raise ValueError('Circular requirements for setup {!r}'.format(setup_name))
+        visiting.add(setup_name)
+        reqs = set()
+        for req in BOOTSTRAP_SETUPS[setup_name].requirements:
+            if req in setups or not installed.get(req):
+                visit(req)
+                reqs.add(req)
+        visiting.remove(setup_name)
+        plan[setup_name] = reqs
+
+    for setup_name in setups:
+        visit(setup_name)
+    return plan
+
+def run_setups(plan):
+    """Runs the setups in the plan returned by resolve_requirements, each as soon as its requirements have finished and its resources are free.
+
+    Returns a dict of (start, end) monotonic timestamps for each setup that ran, and a dict mapping each setup that failed to its exception, or to None if it was skipped because a requirement failed.
+    """
+    timings = {}
+    failures = {}
+
+    def run_setup(setup_name):
+        setup = BOOTSTRAP_SETUPS[setup_name]
+        with contextlib.ExitStack() as stack:
+            for resource in sorted(setup.resources): # sorted to avoid deadlocks
+                stack.enter_context(syncbin.lock(RESOURCE_LOCKS.get(resource, f'bootstrap-{resource}')))
+            start = time.monotonic()
+            try:
+                setup()
+            finally:
+                timings[setup_name] = start, time.monotonic()
+        forget_status(setup_name)
+
+    pending = dict(plan)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(plan), 1)) as executor:
+        running = {}
+        while pending or running:
+            for setup_name, reqs in sorted(pending.items()):
+                if any(req in failures for req in reqs):
+                    failures[setup_name] = None
+                    del pending[setup_name]
+                elif all(req in timings and req not in running.values() for req in reqs):
+                    running[executor.submit(run_setup, setup_name)] = setup_name
+                    del pending[setup_name]
+            if not running:
+                if pending:
+                    raise RuntimeError('No runnable setups left: {}'.format(', '.join(sorted(pending))))
+                break
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                setup_name = running.pop(future)
+                try:
+                    future.result()
+                except (Exception, SystemExit) as e: # some setups call sys.exit with an error message
+                    failures[setup_name] = e
+    return timings, failures
+
+def print_timings(plan, timings):
+    if not timings:
+        return
+    # the critical path is the chain of requirements with the longest total duration, which bounds the total time
+    path_durations = {}
+    path_prev = {}
+    for setup_name in sorted(timings, key=lambda setup_name: timings[setup_name][1]):
+        start, end = timings[setup_name]
+        prev = max((req for req in plan[setup_name] if req in path_durations), key=path_durations.get, default=None)
+        path_prev[setup_name] = prev
+        path_durations[setup_name] = end - start + (0 if prev is None else path_durations[prev])
+    critical_path = [max(path_durations, key=path_durations.get)]
+    while path_prev[critical_path[0]] is not None:
+        critical_path.insert(0, path_prev[critical_path[0]])
+    max_len = max(len(setup_name) for setup_name in timings)
+    print('[ ** ] setup timings:')
+    for setup_name, (start, end) in sorted(timings.items(), key=lambda item: item[1]):
+        print('{}{}  {:7.1f}s{}'.format(setup_name, ' ' * (max_len - len(setup_name)), end - start, '  (critical path)' if setup_name in critical_path else ''))
+    print('[ ** ] critical path: {} ({:.1f}s, total {:.1f}s)'.format(' → '.join(critical_path), path_durations[critical_path[-1]], max(end for start, end in timings.values()) - min(start for start, end in timings.values())))
+
+def bootstrap_help(file=sys.stdout, refresh=False):
+    print('[ ** ] Available setups:', file=file)
+    setups = sorted(BOOTSTRAP_SETUPS.items())
+    max_len = max(len(name) for name, setup in setups)
+    try:
+        blessings = pypi_import('blessings')
+
+        term = blessings.Terminal(stream=file)
+    except Exception:
+        term = None
+        status_sigils = {
+            True: '✓',
+            False: '✗',
+            None: '?',
+        }
+    else:
+        status_sigils = {
+            True: term.bright_green('✓'),
+            False: term.bright_red('✗'),
+            None: term.bright_yellow('?'),
+        }
+    if term is not None and term.is_a_tty:
+        # print all rows right away and fill in the status of each setup as its probe finishes. Rows are cut off at the terminal width so they're one line each.
+        for name, setup in setups:
+            print('{} {}{}  {}'.format('…', name, ' ' * (max_len - len(name)), '(undocumented)' if setup.__doc__ is None else setup.__doc__)[:term.width], file=file)
+        rows_up = {name: len(setups) - i for i, (name, setup) in enumerate(setups)}
+        for name, status in probe_installed(setups, refresh=refresh):
+            print(term.move_up * rows_up[name] + '\r' + status_sigils[status] + '\n' * rows_up[name], end='', flush=True, file=file)
+    else:
+        setups = dict(setups)
+        for name, status in probe_installed(setups.items(), refresh=refresh):
+            setup = setups[name]
+            print('{} {}{}  {}'.format(status_sigils[status], name, ' ' * (max_len - len(name)), '(undocumented)' if setup.__doc__ is None else setup.__doc__), file=file, flush=True)
+    #TODO more details
+
+def probe_installed(setups, timeout=None, refresh=False):
+    """Runs the is_installed probes of the given (name, setup) pairs concurrently.
+
+    Yields (name, status) pairs in the order in which the probes finish. A probe which raises an exception or is still running after timeout seconds (PROBE_TIMEOUT by default) is reported as None (unknown).
+
+    Results are cached in the syncbin cache directory according to the inputs declared with bootstrap_setup, unless refresh is true.
+    """
+    if timeout is None:
+        timeout = PROBE_TIMEOUT
+    statuses = syncbin.load_cache('bootstrap-status.json', default={})
+    statuses_lock = threading.Lock()
+    results = queue.Queue()
+
+    def probe(name, setup):
+        try:
+            signature = status_signature(setup)
+            cached = statuses.get(name)
+            if (
+                not refresh
+                and signature is not None
+                and cached is not None
+                and cached['signature'] == signature
+                and (setup.status_inputs['ttl'] is None or time.time() - cached['time'] < setup.status_inputs['ttl'])
+            ):
+                status = cached['status']
+            else:
+                status = setup.is_installed()
+                with statuses_lock:
+                    if signature is None or status is None:
+                        statuses.pop(name, None)
+                    else:
+                        statuses[name] = {
+                            'signature': signature,
+                            'status': status,
+                            'time': time.time(),
+                        }
+        except Exception:
+            status = None
+        results.put((name, status))
+
+    pending = set()
+    for name, setup in setups:
+        pending.add(name)
+        threading.Thread(target=probe, args=(name, setup), daemon=True).start() # daemon threads so a hanging probe doesn't keep syncbin from exiting
+    deadline = time.monotonic() + timeout
+    while pending:
+        try:
+            name, status = results.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            break
+        pending.remove(name)
+        yield name, status
+    with statuses_lock:
+        syncbin.save_cache('bootstrap-status.json', statuses)
+    for name in sorted(pending):
+        yield name, None
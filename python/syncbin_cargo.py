@@ -0,0 +1,221 @@
+"""Manages the shared cargo target directory used by `rust --all-projects`.
+
+If `rust.sharedTargetDir` is set in syncbin.json (to a path, or to true for a directory in the syncbin cache), all projects are built into one target directory, so dependencies they have in common are only compiled once per toolchain and profile. Builds hold the `rust-target` syncbin lock in shared mode, and eviction holds it exclusively.
+
+The target directory is kept below `rust.sharedTargetDirMaxSize` GiB by evicting the least recently used compilation units. Cargo names each unit's files and directories with the same 16-digit hash, and `rust` records when it last used each unit, based on the artifacts cargo reports in its JSON messages (including fresh ones). Units without a record are dated by the mtime of their files.
+
+This module also runs `cargo sweep --installed` on the target directories of the projects in $GITDIR, for `rust` after updating toolchains. Instead of `cargo sweep -r` searching the entire git tree, target directories are only looked for a few levels deep, at the roots of gitdir checkouts and their immediate subdirectories. An index in the syncbin cache records the mtimes of each target directory as of its last sweep, along with the installed toolchains, and target directories are only swept again if they might contain artifacts from a toolchain which has since been updated or removed.
+"""
+
+import json
+import os
+import pathlib
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+import syncbin
+import syncbin_rustup
+
+DEFAULT_MAX_SIZE = 20 # GiB
+USAGE_FILE = '.syncbin-usage.json'
+UNIT_DIRS = ['.fingerprint', 'build', 'deps', 'incremental']
+SWEEP_PATTERNS = ['*/*/*/target', '*/*/*/*/target', '*/*/*/*/*/target'] # host/repo/branch, host/user/repo/branch, and a crate in a subdirectory of the latter
+UNIT_HASH = re.compile('-([0-9a-f]{16})(?:[.]|$)')
+
+_usage_lock = threading.Lock()
+
+def shared_target_dir(config):
+    """The shared target directory configured in syncbin.json, or None if each project uses its own."""
+    value = config.get('rust', {}).get('sharedTargetDir')
+    if value is True:
+        return syncbin.cache_dir() / 'cargo-target'
+    if value:
+        return pathlib.Path(value).expanduser()
+
+def max_size(config):
+    """The size in bytes above which units are evicted from the shared target directory."""
+    return int(config.get('rust', {}).get('sharedTargetDirMaxSize', DEFAULT_MAX_SIZE) * 1024 ** 3)
+
+def unit_key(path):
+    """Returns the hash identifying the compilation unit a path in a target directory belongs to, or None if it isn't part of a single unit."""
+    path = pathlib.Path(path)
+    for name in (path.name, path.parent.name):
+        match = UNIT_HASH.search(name)
+        if match:
+            return match.group(1)
+
+def artifacts(message):
+    """Returns the paths in a message from `cargo --message-format=json` which belong to compilation units."""
+    if message.get('reason') == 'compiler-artifact':
+        return message.get('filenames', [])
+    if message.get('reason') == 'build-script-executed':
+        return [message['out_dir']]
+    return []
+
+def record_usage(target_dir, paths):
+    """Marks the units containing the given artifact paths as used now."""
+    keys = {key for key in map(unit_key, paths) if key is not None}
+    if not keys:
+        return
+    now = time.time()
+    with _usage_lock:
+        usage = load_usage(target_dir)
+        for key in keys:
+            usage[key] = now
+        save_usage(target_dir, usage)
+
+def load_usage(target_dir):
+    try:
+        with (target_dir / USAGE_FILE).open() as usage_f:
+            return json.load(usage_f)
+    except (OSError, ValueError):
+        return {}
+
+def save_usage(target_dir, usage):
+    tmp_path = target_dir / f'.{USAGE_FILE}.{os.getpid()}.tmp'
+    try:
+        with tmp_path.open('w') as usage_f:
+            json.dump(usage, usage_f)
+        tmp_path.replace(target_dir / USAGE_FILE)
+    except OSError:
+        pass # only makes eviction less accurate
+
+def disk_usage(path):
+    if path.is_symlink() or not path.is_dir():
+        stat = path.lstat()
+        return stat.st_size, stat.st_mtime
+    size = 0
+    mtime = path.lstat().st_mtime
+    for dir_path, dir_names, file_names in os.walk(path):
+        for name in file_names:
+            try:
+                stat = os.lstat(os.path.join(dir_path, name))
+            except OSError:
+                continue
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime)
+    return size, mtime
+
+def profile_dirs(target_dir):
+    """The directories for each profile and target triple, e.g. `debug` and `x86_64-unknown-linux-gnu/release`."""
+    for fingerprint_dir in (*target_dir.glob('*/.fingerprint'), *target_dir.glob('*/*/.fingerprint')):
+        yield fingerprint_dir.parent
+
+def units(target_dir):
+    """Returns a dict mapping each unit key to its paths, total size in bytes, and last use."""
+    usage = load_usage(target_dir)
+    result = {}
+    for profile_dir in profile_dirs(target_dir):
+        for unit_dir in UNIT_DIRS:
+            try:
+                entries = list((profile_dir / unit_dir).iterdir())
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                match = UNIT_HASH.search(entry.name)
+                key = match.group(1) if match else str(entry) # incremental dirs use a different hash, so they're their own units
+                try:
+                    size, mtime = disk_usage(entry)
+                except OSError:
+                    continue
+                unit = result.setdefault(key, {'paths': [], 'size': 0, 'mtime': 0})
+                unit['paths'].append(entry)
+                unit['size'] += size
+                unit['mtime'] = max(unit['mtime'], mtime)
+    for key, unit in result.items():
+        unit['lastUsed'] = max(usage.get(key, 0), unit['mtime'])
+    return result
+
+def evict(target_dir, max_size, *, keep_since=None):
+    """Deletes the least recently used units until the target directory is no larger than max_size bytes. Units used at or after keep_since are never deleted. Returns the number of deleted units and the number of bytes they took up."""
+    with syncbin.lock('rust-target'):
+        all_units = units(target_dir)
+        total = sum(unit['size'] for unit in all_units.values())
+        evicted = freed = 0
+        for key, unit in sorted(all_units.items(), key=lambda item: item[1]['lastUsed']):
+            if total <= max_size:
+                break
+            if keep_since is not None and unit['lastUsed'] >= keep_since:
+                break # everything from here on is newer
+            for path in unit['paths']:
+                if path.is_dir() and not path.is_symlink():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink(missing_ok=True)
+            del all_units[key]
+            total -= unit['size']
+            evicted += 1
+            freed += unit['size']
+        usage = load_usage(target_dir)
+        save_usage(target_dir, {key: last_used for key, last_used in usage.items() if key in all_units})
+    return evicted, freed
+
+def target_dirs(root):
+    """The cargo target directories in the gitdir at root. Only the paths matching SWEEP_PATTERNS are searched."""
+    for pattern in SWEEP_PATTERNS:
+        for rustc_info in root.glob(f'{pattern}/.rustc_info.json'): # written by cargo to the root of every target directory
+            yield rustc_info.parent
+
+def target_stamp(target_dir):
+    """The mtimes of the target directory and the `.fingerprint` directories in it. Cargo adds an entry to a `.fingerprint` directory for every compilation unit it builds, including units built by a different toolchain, and sweeping removes entries from it."""
+    return {
+        str(path.relative_to(target_dir)): path.stat().st_mtime_ns
+        for path in (target_dir, *(profile_dir / '.fingerprint' for profile_dir in profile_dirs(target_dir)))
+    }
+
+def _still_installed(toolchains, installed):
+    return all(installed.get(name) == stamp for name, stamp in toolchains.items())
+
+def needs_sweep(record, stamp, last_toolchains, installed):
+    """Whether a target directory might contain artifacts from a toolchain which isn't installed anymore.
+
+    record is the target directory's entry in the sweep index, stamp its current target_stamp, last_toolchains the installed toolchains as of the last sweep, and installed the toolchains installed now. A target directory which is unchanged since it was last swept only contains artifacts from the toolchains installed at that time, and one which changed since then may also contain artifacts from any toolchain installed since the last sweep. Unless a toolchain has been updated or removed since, neither needs to be swept.
+    """
+    if record is None or last_toolchains is None:
+        return True
+    if not _still_installed(record['toolchains'], installed):
+        return True
+    return record['stamp'] != stamp and not _still_installed(last_toolchains, installed)
+
+def sweep(root):
+    """Runs `cargo sweep --installed` on the target directories in the gitdir at root which need it. Returns the number of target directories swept and the number found."""
+    with syncbin.lock('cargo-sweep'):
+        index = syncbin.load_cache('cargo-sweep.json', default={})
+        installed = syncbin_rustup.installed_toolchains()
+        last_toolchains = index.get('toolchains')
+        records = index.get('targets', {})
+        new_records = {}
+        # like rust.env, since cargo may not be on the PATH, e.g. in cron
+        cargo_env = {**os.environ, 'PATH': '{}:{}'.format(pathlib.Path.home() / '.cargo' / 'bin', os.environ.get('PATH', os.defpath))}
+        swept = found = 0
+        ok = True
+        for target_dir in target_dirs(root):
+            found += 1
+            try:
+                stamp = target_stamp(target_dir)
+            except OSError:
+                continue # deleted during the sweep
+            record = records.get(str(target_dir))
+            if needs_sweep(record, stamp, last_toolchains, installed):
+                swept += 1
+                # cargo sweep takes the project directory and asks cargo for its target directory
+                try:
+                    returncode = subprocess.run(['cargo', 'sweep', '--installed', str(target_dir.parent)], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, env=cargo_env).returncode
+                except OSError:
+                    returncode = None # e.g. cargo not installed
+                if returncode != 0:
+                    ok = False
+                    if record is not None:
+                        new_records[str(target_dir)] = record # try again next time
+                    continue
+                try:
+                    stamp = target_stamp(target_dir)
+                except OSError:
+                    continue
+            new_records[str(target_dir)] = {'stamp': stamp, 'toolchains': installed}
+        # if a sweep failed, an unswept new or changed target directory must not be considered clean next time
+        syncbin.save_cache('cargo-sweep.json', {'toolchains': installed if ok else index.get('toolchains'), 'targets': new_records})
+    return swept, found
@@ -0,0 +1,70 @@
+"""Checks for cronjobs, for `syncbin has-cronjob` and the startup steps which leave updates to a cronjob if there is one.
+
+Listing a crontab takes a `crontab -l` subprocess, and root's crontab a `sudo -n crontab -l`. Both are read once into a snapshot which answers any number of patterns, and the snapshot is cached in the syncbin cache directory until the cron spool directory changes (`crontab` replaces the file in the spool directory whenever a crontab is edited). On platforms where the spool directory isn't known, nothing is cached on disk.
+"""
+
+import os
+import subprocess
+
+import syncbin
+
+SPOOL_DIRS = [
+    '/var/spool/cron/crontabs', # Debian
+    '/var/spool/cron', # Red Hat, Arch
+    '/usr/lib/cron/tabs', # macOS
+    '/var/cron/tabs', # BSD
+]
+CRONTAB_COMMANDS = {
+    'user': ['crontab', '-l'],
+    'root': ['sudo', '-n', 'crontab', '-l'],
+}
+
+class Snapshot:
+    """The contents of the user's and root's crontabs at one point in time."""
+
+    def __init__(self, crontabs):
+        self.crontabs = crontabs # dict mapping the keys of CRONTAB_COMMANDS to the crontab's contents, or None if it couldn't be read
+        self._index = {}
+
+    def find(self, pattern):
+        """Returns the name of the first crontab ('user' or 'root') containing pattern, or None if neither does."""
+        if pattern not in self._index:
+            self._index[pattern] = next((crontab_name for crontab_name, crontab in self.crontabs.items() if crontab is not None and pattern in crontab), None)
+        return self._index[pattern]
+
+def spool_key():
+    """Something which changes when any crontab is edited, or None if there's no known spool directory on this system."""
+    key = {}
+    for path in SPOOL_DIRS:
+        try:
+            key[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+    if key:
+        return {'uid': os.getuid(), 'spool': key}
+
+def read_crontab(cmd, *, run=subprocess.run):
+    try:
+        result = run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8', errors='replace')
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None # no crontab, or sudo needs a password
+    return result.stdout
+
+def snapshot(*, refresh=False, run=subprocess.run):
+    """Returns a Snapshot of the crontabs, from the cache unless it's outdated or refresh is true. Subprocesses are started using run, which takes the same arguments as subprocess.run."""
+    key = spool_key()
+    if key is not None and not refresh:
+        cached = syncbin.load_cache('crontabs.json', default={})
+        if cached.get('key') == key:
+            return Snapshot(cached['crontabs'])
+    crontabs = {crontab_name: read_crontab(cmd, run=run) for crontab_name, cmd in CRONTAB_COMMANDS.items()}
+    if key is not None:
+        syncbin.save_cache('crontabs.json', {'key': key, 'crontabs': crontabs})
+    return Snapshot(crontabs)
+
+def has_cronjob(*patterns, refresh=False):
+    """Returns a dict mapping each pattern to the name of the crontab containing it, or None if there is no cronjob matching it."""
+    crontabs = snapshot(refresh=refresh)
+    return {pattern: crontabs.find(pattern) for pattern in patterns}
@@ -0,0 +1,141 @@
+"""Checks for internet connectivity, for `syncbin hasinet` and the startup steps which need it.
+
+Several cheap checks race each other in daemon threads: a TCP connection to the target, a DNS lookup of its host name, and (on Linux) whether there is a default route at all. The first check to succeed decides, and if there is no default route the result is negative without waiting for the others. The result is cached in the syncbin cache directory for a few seconds, or until the network configuration changes.
+
+The target defaults to DEFAULT_TARGET and can be overridden with the SYNCBIN_HASINET_TARGET environment variable, e.g. to point it at a local listener for testing.
+"""
+
+import os
+import queue
+import socket
+import threading
+import time
+
+import syncbin
+
+DEFAULT_TARGET = 'fenhl.net:443'
+TIMEOUT = 3 # seconds until all checks count as failed
+TTL_ONLINE = 60
+TTL_OFFLINE = 10 # shorter so that reconnecting is noticed quickly
+
+def target():
+    return os.environ.get('SYNCBIN_HASINET_TARGET') or DEFAULT_TARGET
+
+def parse_target(host_port):
+    host, _, port = host_port.rpartition(':')
+    if not host:
+        raise ValueError(f'expected host:port, got {host_port!r}')
+    return host.strip('[]'), int(port)
+
+def network_key():
+    """Something which changes when the network interfaces or routes change."""
+    import hashlib
+
+    key = hashlib.sha256()
+    for path in ('/proc/net/route', '/proc/net/ipv6_route', '/etc/resolv.conf'):
+        try:
+            with open(path, 'rb') as f:
+                key.update(f.read())
+        except OSError:
+            key.update(b'\0')
+    try:
+        key.update(repr(socket.if_nameindex()).encode())
+    except OSError:
+        pass
+    return key.hexdigest()
+
+def is_loopback(host):
+    import ipaddress
+
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def has_default_route():
+    """Returns False if the kernel has no default route, True if it has one, or None if that can't be checked on this platform."""
+    found_table = False
+    for path, has_header, is_default in (
+        ('/proc/net/route', True, lambda fields: fields[1] == '00000000' and fields[7] == '00000000'),
+        ('/proc/net/ipv6_route', False, lambda fields: fields[0] == '0' * 32 and fields[1] == '00' and fields[9] != 'lo'),
+    ):
+        try:
+            with open(path) as f:
+                lines = f.read().splitlines()
+        except OSError:
+            continue
+        found_table = True
+        if any(is_default(line.split()) for line in lines[1 if has_header else 0:] if line.strip()):
+            return True
+    return False if found_table else None
+
+def _check_tcp(host, port, timeout):
+    with socket.create_connection((host, port), timeout=timeout):
+        return True
+
+def _check_dns(host, port, timeout):
+    import ipaddress
+
+    if is_loopback(host):
+        return None # resolved locally, so it says nothing about the connection
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return bool(socket.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+    else:
+        return None # nothing to look up
+
+def _check_route(host, port, timeout):
+    if is_loopback(host):
+        return None # doesn't need a route
+    return has_default_route()
+
+CHECKS = {
+    'dns': _check_dns,
+    'route': _check_route,
+    'tcp': _check_tcp,
+}
+
+def probe(host_port=None, *, timeout=TIMEOUT):
+    """Runs the checks without using the cache. Returns whether the internet (or the given host:port) seems to be reachable."""
+    host, port = parse_target(target() if host_port is None else host_port)
+    deadline = time.monotonic() + timeout
+    results = queue.Queue()
+
+    def run(check_name, check):
+        try:
+            result = check(host, port, timeout)
+        except Exception:
+            result = False
+        results.put((check_name, result))
+
+    for check_name, check in CHECKS.items():
+        # daemon threads so a hanging DNS lookup doesn't keep the process alive
+        threading.Thread(target=run, args=(check_name, check), daemon=True).start()
+    for _ in range(len(CHECKS)):
+        try:
+            check_name, result = results.get(timeout=max(0, deadline - time.monotonic()))
+        except queue.Empty:
+            return False
+        if check_name == 'route':
+            if result is False:
+                return False # no network at all, don't wait for the others to time out
+        elif result:
+            return True
+    return False
+
+def has_internet(host_port=None, *, refresh=False):
+    """Like probe, but cached for TTL_ONLINE or TTL_OFFLINE seconds, or until the network configuration changes."""
+    if host_port is None:
+        host_port = target()
+    key = {'target': host_port, 'network': network_key()}
+    cached = syncbin.load_cache('hasinet.json', default={})
+    if not refresh and cached.get('key') == key:
+        age = time.time() - cached['time']
+        if 0 <= age < (TTL_ONLINE if cached['result'] else TTL_OFFLINE):
+            return cached['result']
+    result = probe(host_port)
+    syncbin.save_cache('hasinet.json', {'key': key, 'result': result, 'time': time.time()})
+    return result
@@ -0,0 +1,219 @@
+"""Named locks shared between syncbin processes.
+
+The locks are POSIX record locks (`fcntl.lockf`) on files in /tmp, which are the same kind of lock as `zsystem flock` in Zsh, so they also exclude the `lock` function in `syncbin-startup`. The kernel releases them when the holding process dies, so there are no stale locks to clean up.
+"""
+
+import atexit
+import fcntl
+import os
+import threading
+import time
+
+import syncbin
+
+# record locks belong to a process, not to a file descriptor, so threads of the same process have to be kept apart separately
+_states = {}
+_states_lock = threading.Lock()
+
+STATS = {}
+_pending = None # stats not yet merged into the stats file, or None if flush_stats isn't registered yet
+_stats_lock = threading.Lock()
+
+def lock_path(lock_name):
+    return f'/tmp/syncbin-startup-{lock_name}.flock'
+
+class _State:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.busy = False # a thread is currently waiting for the kernel lock
+        self.fd = None
+        self.holders = 0
+        self.shared = False
+
+def _state(lock_name):
+    with _states_lock:
+        return _states.setdefault(lock_name, _State())
+
+def _add_stats(stats, deltas):
+    for key, delta in deltas.items():
+        if key.startswith('max'):
+            stats[key] = max(stats.get(key, 0), delta)
+        else:
+            stats[key] = stats.get(key, 0) + delta
+
+def _record(lock_name, **deltas):
+    global _pending
+
+    with _stats_lock:
+        _add_stats(STATS.setdefault(lock_name, {}), deltas)
+        if _pending is None:
+            _pending = {}
+            atexit.register(flush_stats)
+        _add_stats(_pending.setdefault(lock_name, {}), deltas)
+
+def flush_stats():
+    """Merges the stats recorded by this process since the last flush into the stats of previous runs. Called automatically at exit, so acquiring and releasing locks doesn't have to touch the stats file."""
+    global _pending
+
+    with _stats_lock:
+        if not _pending:
+            return
+        pending, _pending = _pending, {}
+        # the stats file is replaced when saved, so the lock is on a separate file
+        try:
+            syncbin.cache_dir().mkdir(parents=True, exist_ok=True)
+            stats_fd = os.open(syncbin.cache_dir() / 'lock-stats.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            return
+        try:
+            fcntl.lockf(stats_fd, fcntl.LOCK_EX)
+            all_stats = syncbin.load_cache('lock-stats.json', default={})
+            for lock_name, deltas in pending.items():
+                _add_stats(all_stats.setdefault(lock_name, {}), deltas)
+            syncbin.save_cache('lock-stats.json', all_stats)
+        finally:
+            os.close(stats_fd) # also releases the lock
+
+class Lock:
+    """A named lock which can be held by multiple readers (shared=True) or a single writer.
+
+    With timeout=None, acquiring blocks until the lock is available. Otherwise, TimeoutError is raised after that many seconds.
+    """
+
+    def __init__(self, lock_name, *, shared=False, timeout=None):
+        self.name = lock_name
+        self.path = lock_path(lock_name)
+        self.shared = shared
+        self.timeout = timeout
+        self.acquired_at = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.name!r}, shared={self.shared!r}, timeout={self.timeout!r})'
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = None if self.timeout is None else start + self.timeout
+        state = _state(self.name)
+        contended = False
+        joined = False
+        with state.cond:
+            while True:
+                if not state.busy and state.holders == 0:
+                    state.busy = True
+                    break
+                if not state.busy and self.shared and state.shared:
+                    # another thread of this process already holds the kernel lock in shared mode
+                    state.holders += 1
+                    joined = True
+                    break
+                contended = True
+                if deadline is None:
+                    state.cond.wait()
+                elif not state.cond.wait(max(0, deadline - time.monotonic())):
+                    self._timed_out(start)
+        if joined:
+            self._acquired(start, contended)
+            return
+        try:
+            fd, kernel_contended = self._acquire_kernel_lock(start, deadline)
+        except BaseException:
+            with state.cond:
+                state.busy = False
+                state.cond.notify_all()
+            raise
+        with state.cond:
+            state.busy = False
+            state.fd = fd
+            state.holders = 1
+            state.shared = self.shared
+            state.cond.notify_all()
+        self._acquired(start, contended or kernel_contended)
+
+    def _acquire_kernel_lock(self, start, deadline):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            try:
+                os.fchmod(fd, 0o666) # allow other users to take the lock too
+            except PermissionError:
+                pass # created by another user
+            operation = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+            try:
+                fcntl.lockf(fd, operation | fcntl.LOCK_NB)
+            except (BlockingIOError, PermissionError):
+                pass
+            else:
+                return fd, False
+            if deadline is None:
+                fcntl.lockf(fd, operation)
+                return fd, True
+            # lockf has no timeout, so poll with a short backoff
+            interval = 0.01
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timed_out(start)
+                time.sleep(min(interval, remaining))
+                interval = min(interval * 2, 0.25)
+                try:
+                    fcntl.lockf(fd, operation | fcntl.LOCK_NB)
+                except (BlockingIOError, PermissionError):
+                    continue
+                return fd, True
+        except BaseException:
+            os.close(fd)
+            raise
+
+    def _acquired(self, start, contended):
+        self.acquired_at = time.monotonic()
+        wait_time = self.acquired_at - start
+        _record(self.name, acquisitions=1, contended=int(contended), waitTime=wait_time, maxWaitTime=wait_time)
+
+    def _timed_out(self, start):
+        _record(self.name, timeouts=1, waitTime=time.monotonic() - start)
+        raise TimeoutError(f'timed out waiting for syncbin lock {self.name!r}')
+
+    def release(self):
+        if self.acquired_at is None:
+            raise RuntimeError(f'syncbin lock {self.name!r} released without being acquired')
+        hold_time = time.monotonic() - self.acquired_at
+        self.acquired_at = None
+        state = _state(self.name)
+        with state.cond:
+            state.holders -= 1
+            if state.holders == 0:
+                fcntl.lockf(state.fd, fcntl.LOCK_UN)
+                os.close(state.fd)
+                state.fd = None
+                state.cond.notify_all()
+        _record(self.name, holdTime=hold_time, maxHoldTime=hold_time)
+
+def lock_stats():
+    """Returns the lock counters of all syncbin processes so far, as stored in the syncbin cache directory."""
+    flush_stats()
+    return syncbin.load_cache('lock-stats.json', default={})
+
+def print_lock_stats(file=None):
+    stats = lock_stats()
+    if not stats:
+        print('[ ** ] no lock stats recorded yet', file=file)
+        return
+    max_len = max(len(name) for name in stats)
+    print('{}  {:>8}  {:>9}  {:>8}  {:>10}  {:>10}  {:>10}'.format('lock'.ljust(max_len), 'acquired', 'contended', 'timeouts', 'avg wait', 'max wait', 'avg hold'), file=file)
+    for name, lock_counters in sorted(stats.items()):
+        acquisitions = lock_counters.get('acquisitions', 0)
+        print('{}  {:>8}  {:>9}  {:>8}  {:>9.3f}s  {:>9.3f}s  {:>9.3f}s'.format(
+            name.ljust(max_len),
+            acquisitions,
+            lock_counters.get('contended', 0),
+            lock_counters.get('timeouts', 0),
+            lock_counters.get('waitTime', 0) / max(acquisitions, 1),
+            lock_counters.get('maxWaitTime', 0),
+            lock_counters.get('holdTime', 0) / max(acquisitions, 1),
+        ), file=file)
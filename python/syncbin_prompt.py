@@ -0,0 +1,699 @@
+"""RPROMPT segments, served by `syncbin prompt-daemon`.
+
+Each script in rprompt/ is a segment of the right prompt. Running all of them on every prompt redraw forks a dozen shells plus the git, rustup, python3, jq, sudo and needrestart processes they spawn, so the daemon computes the segments in the background and caches them per directory. A cached segment is recomputed when one of the files it watches changes (e.g. `.git/HEAD` or `~/.rustup/settings.toml`) and refreshed in the background when its time to live expires.
+
+The client is the `syncbin-rprompt` precmd hook in config/fenhl.zsh-theme, which talks to the daemon's Unix socket using zsh/net/socket and stores the response in a variable used by RPROMPT, so it doesn't fork. The socket is in a directory only the user can access, see socket_dir, and the client only connects to it if it's owned by the user. A request is the working directory followed by NAME=value pairs for the environment variables in CLIENT_ENV, each terminated by a NUL byte, with an extra NUL byte at the end. The response is the rendered segments, after which the daemon closes the connection.
+"""
+
+import sys
+
+import concurrent.futures
+import contextlib
+import os
+import pathlib
+import shutil
+import signal
+import socket
+import socketserver
+import subprocess
+import threading
+import time
+
+import syncbin
+import syncbin_rustup
+
+RPROMPT_DIR = pathlib.Path(__file__).resolve().parent.parent / 'rprompt'
+CLIENT_ENV = ['MAILPATH', 'STY', 'VIRTUAL_ENV'] # must match the variables sent by `syncbin-rprompt` in fenhl.zsh-theme
+DEFAULT_TTL = 5 # for segments without a declaration below
+IDLE_TIMEOUT = 60 * 60 # the daemon exits after this many seconds without requests, the prompt starts it again when needed
+KEEP_UNUSED = 10 * 60 # cached segments which haven't been requested for this many seconds are dropped
+SCRIPT_TIMEOUT = 10
+KEEP_RENDERED = 24 * 60 * 60 # outputs cached by `syncbin rprompt` which haven't been updated for this many seconds are dropped
+
+PROMPT_SEGMENTS = {}
+
+def prompt_segment(segment_name, *, per_dir=False, env=(), watch=None, ttl=None, background=False, persist=False):
+    """Registers an RPROMPT segment, replacing the script of the same name in rprompt/.
+
+    The decorated function takes the working directory and a dict of the client's environment variables in CLIENT_ENV, and returns the segment's output. Segments with per_dir=True are cached separately for each working directory, and all segments are cached separately for each value of the environment variables named in env.
+
+    watch is a function taking the same arguments and returning paths. The cached segment is recomputed before it's served if the mtime of any of these paths changes. After ttl seconds, the cached segment is still served but recomputed in the background. With neither, the segment is computed only once per cache key.
+
+    Segments with background=True are never computed while a prompt waits for them: the last output (or nothing) is served while they're recomputed in the background. Segments with persist=True keep their last output in the syncbin cache directory, so a newly started daemon can serve it until the watched paths change or the machine reboots. Only segments with per_dir=False and no env can be persisted.
+    """
+    def inner_wrapper(f):
+        PROMPT_SEGMENTS[segment_name] = f
+        f.segment_name = segment_name
+        f.per_dir = per_dir
+        f.env = tuple(env)
+        f.watch = (lambda cwd, env: ()) if watch is None else watch
+        f.ttl = ttl
+        f.background = background
+        f.persist = persist
+        f.is_script = False
+        return f
+    return inner_wrapper
+
+def script_segment(segment_name, **kwargs):
+    """Registers an RPROMPT segment which runs its script in rprompt/. Keyword arguments are as for prompt_segment."""
+    def run(cwd, env):
+        return run_script(segment_name, cwd, env)
+
+    run = prompt_segment(segment_name, **kwargs)(run)
+    run.is_script = True
+    return run
+
+def run_script(segment_name, cwd, env):
+    script_env = {**os.environ, **env}
+    if os.path.isdir(cwd):
+        script_env['PWD'] = cwd
+    else:
+        cwd = '/'
+    return subprocess.run([str(RPROMPT_DIR / f'{segment_name}.sh')], cwd=cwd, env=script_env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8', errors='replace', timeout=SCRIPT_TIMEOUT, check=True).stdout
+
+def segment_names():
+    """Returns the names of all segments, in the order in which they're rendered."""
+    names = set(PROMPT_SEGMENTS)
+    with contextlib.suppress(FileNotFoundError):
+        names.update(path.stem for path in RPROMPT_DIR.iterdir() if path.suffix == '.sh')
+    return sorted(names)
+
+def get_segment(segment_name):
+    if segment_name not in PROMPT_SEGMENTS:
+        # a new script without a declaration here, assume the worst
+        script_segment(segment_name, per_dir=True, env=CLIENT_ENV, ttl=DEFAULT_TTL)
+    return PROMPT_SEGMENTS[segment_name]
+
+def mail_dirs(env):
+    # same syntax as zsh's $mailpath, where each entry can be followed by ? and a message
+    return [entry.split('?', 1)[0] for entry in env.get('MAILPATH', '').split(':') if entry]
+
+def find_git_dir(cwd):
+    """Returns the .git file or directory of the repo containing cwd, the git directory, and the common directory shared by worktrees, or None if cwd isn't in a git repo."""
+    path = pathlib.Path(cwd)
+    for repo in (path, *path.parents):
+        dot_git = repo / '.git'
+        if dot_git.is_dir():
+            git_dir = dot_git
+            break
+        if dot_git.is_file():
+            # a worktree or submodule
+            try:
+                git_dir = repo / dot_git.read_text().split('gitdir:', 1)[1].strip()
+            except (IndexError, OSError):
+                return None
+            break
+    else:
+        return None
+    try:
+        common_dir = git_dir / (git_dir / 'commondir').read_text().strip()
+    except OSError:
+        common_dir = git_dir
+    return dot_git, git_dir, common_dir
+
+def git_watch_paths(cwd, env):
+    """The files in the git directory of the repo containing cwd which change when the git segment might be different, except for changes to the working tree."""
+    git_dirs = find_git_dir(cwd)
+    if git_dirs is None:
+        return [cwd, os.path.join(cwd, '.git')]
+    dot_git, git_dir, common_dir = git_dirs
+    paths = [dot_git, git_dir / 'HEAD', git_dir / 'index', common_dir / 'packed-refs', common_dir / 'refs' / 'heads', common_dir / 'refs' / 'remotes' / 'origin', common_dir / 'refs' / 'remotes' / 'origin' / 'HEAD']
+    with contextlib.suppress(OSError, IndexError):
+        head = (git_dir / 'HEAD').read_text()
+        if head.startswith('ref: refs/heads/'):
+            branch = head[len('ref: refs/heads/'):].strip()
+            paths.append(common_dir / 'refs' / 'heads' / branch)
+            paths.append(common_dir / 'refs' / 'remotes' / 'origin' / branch)
+    return paths
+
+script_segment('battery', ttl=60)
+
+@prompt_segment('cwd', per_dir=True, watch=lambda cwd, env: [cwd])
+def prompt_cwd(cwd, env):
+    return '' if os.path.isdir(cwd) else '[cwd: does not exist]\n'
+
+script_segment('disk', ttl=60)
+
+_origin_heads = {}
+
+def origin_head(common_dir):
+    """The default branch of the origin remote, or master if unknown, like `git branch -a | grep '  remotes/origin/HEAD -> origin/' | cut -d'/' -f4` in `rprompt/git.sh`. Memoized by the mtimes of the refs."""
+    head_path = common_dir / 'refs' / 'remotes' / 'origin' / 'HEAD'
+    key = signature([head_path, common_dir / 'packed-refs', common_dir / 'refs' / 'remotes' / 'origin'])
+    if head_path not in _origin_heads or _origin_heads[head_path][0] != key:
+        head_branch = 'master'
+        with contextlib.suppress(OSError):
+            ref = head_path.read_text().strip()
+            if ref.startswith('ref: refs/remotes/origin/'):
+                target = ref[len('ref: '):]
+                # `git branch -a` omits origin/HEAD if it points to a missing branch
+                if (common_dir / target).is_file() or target_is_packed(common_dir, target):
+                    # cut -d'/' -f4 of `  remotes/origin/HEAD -> origin/<branch>`
+                    head_branch = target[len('refs/remotes/origin/'):].split('/')[0]
+        _origin_heads[head_path] = key, head_branch
+    return _origin_heads[head_path][1]
+
+def target_is_packed(common_dir, ref):
+    try:
+        with (common_dir / 'packed-refs').open(encoding='utf-8', errors='replace') as packed_refs:
+            return any(line.rstrip('\n').endswith(f' {ref}') for line in packed_refs)
+    except OSError:
+        return False
+
+def upstream_relation(cwd, current_branch, headers):
+    """Returns (ahead), (behind), (diverged), or None if HEAD is at origin/<current_branch>.
+
+    Like `rprompt/git.sh`, this compares with origin/<current_branch> regardless of the configured upstream, and a missing origin/<current_branch> counts as diverged.
+    """
+    if headers['branch.upstream'] == f'origin/{current_branch}':
+        if 'branch.ab' not in headers:
+            return '(diverged)' # the upstream branch is gone
+        ahead, behind = (int(count.lstrip('+-')) for count in headers['branch.ab'].split())
+    else:
+        def git(*args):
+            return subprocess.run(['git', *args], cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8', errors='replace').stdout.strip()
+
+        current_rev = headers['branch.oid']
+        remote_rev = git('rev-parse', f'origin/{current_branch}')
+        if current_rev == remote_rev:
+            return None
+        shared_rev = git('merge-base', current_rev, remote_rev)
+        ahead = current_rev != shared_rev
+        behind = remote_rev != shared_rev
+    if ahead and behind:
+        return '(diverged)'
+    elif ahead:
+        return '(ahead)'
+    elif behind:
+        return '(behind)'
+    else:
+        return None
+
+@prompt_segment('git', per_dir=True, watch=git_watch_paths, ttl=DEFAULT_TTL) # the TTL catches changes to the working tree, which aren't watched
+def prompt_git(cwd, env):
+    """Same output as `rprompt/git.sh`, but from a single `git status` instead of nine git invocations."""
+    try:
+        status = subprocess.run(['git', '--no-optional-locks', 'status', '--porcelain=v2', '--branch'], cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8', errors='replace', timeout=SCRIPT_TIMEOUT)
+    except (FileNotFoundError, NotADirectoryError):
+        return ''
+    if status.returncode != 0:
+        return ''
+    headers = {}
+    codes = set()
+    for line in status.stdout.splitlines():
+        if line.startswith('# '):
+            key, _, value = line[2:].partition(' ')
+            headers[key] = value
+        elif line.startswith(('1 ', '2 ', 'u ')):
+            codes.add(line[2:4].replace('.', ' '))
+        elif line.startswith('? '):
+            codes.add('??')
+    flags = ''
+    if '??' in codes:
+        flags += '?'
+    if any('D' in code for code in codes):
+        flags += '-'
+    if any('M' in code for code in codes):
+        flags += '≠'
+    if any(code.startswith('A') for code in codes):
+        flags += '+'
+    words = []
+    if headers.get('branch.oid') == '(initial)' or headers.get('branch.head') == '(detached)':
+        current_branch = 'HEAD' # like `git rev-parse --abbrev-ref HEAD`, which also prints HEAD before the first commit
+    else:
+        current_branch = headers.get('branch.head', 'HEAD')
+    git_dirs = find_git_dir(cwd)
+    if ('master' if git_dirs is None else origin_head(git_dirs[2])) != current_branch:
+        words.append(current_branch)
+    if 'branch.upstream' in headers and current_branch != 'HEAD':
+        relation = upstream_relation(cwd, current_branch, headers)
+        if relation is not None:
+            words.append(relation)
+    if not flags and not words:
+        return ''
+    return '[git: {}]'.format(' '.join(filter(None, [flags, *words])))
+
+script_segment('mail', env=['MAILPATH'], watch=lambda cwd, env: [os.path.join(mail_dir, 'cur') for mail_dir in mail_dirs(env)])
+
+def needrestart_watch_paths(cwd, env):
+    """needrestart's kernel check only changes when packages are installed or kernel images change. A reboot restarts the daemon anyway."""
+    try:
+        boot_files = sorted(os.listdir('/boot'))
+    except OSError:
+        boot_files = []
+    return ['/var/lib/dpkg/status', '/boot', *(os.path.join('/boot', boot_file) for boot_file in boot_files)]
+
+@prompt_segment('needrestart', watch=needrestart_watch_paths, background=True, persist=True) # scans all processes and kernel images, so don't make the prompt wait
+def prompt_needrestart(cwd, env):
+    """Same output as `rprompt/needrestart.sh`."""
+    if not syncbin.root():
+        return ''
+    if shutil.which('needrestart') is None:
+        return '[needrestart: not installed]' if os.uname().sysname == 'Linux' else ''
+    # https://github.com/liske/needrestart/issues/22#issuecomment-209585427
+    output = subprocess.run(['sudo', '-n', 'needrestart', '-b'], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8', errors='replace').stdout
+    for line in output.splitlines():
+        if line.startswith('NEEDRESTART-KSTA:'):
+            kernel_status = line.split()[1:2]
+            break
+    else:
+        return ''
+    if kernel_status == ['0']:
+        try:
+            with open('/proc/version') as proc_version:
+                proc_version = proc_version.read()
+        except OSError:
+            proc_version = ''
+        if 'Microsoft' in proc_version or 'WSL' in proc_version:
+            return '' # running on WSL, no needrestart support yet, skip for now
+        return '[needrestart: unknown]'
+    elif kernel_status == ['2']:
+        return '[needrestart: kernel upgrade]'
+    elif kernel_status == ['3']:
+        return '[needrestart: new kernel version]'
+    else:
+        return '' # 1 means the kernel is up to date
+
+script_segment('pi', ttl=30)
+
+@prompt_segment('reboot', watch=lambda cwd, env: ['/opt/dev/reboot.json'])
+def prompt_reboot(cwd, env):
+    """Same output as `rprompt/reboot.sh`, without piping the file through jq twice."""
+    import json
+
+    path = '/opt/dev/reboot.json'
+    if not os.path.lexists(path):
+        return ''
+    if not os.path.isfile(path):
+        return f'[reboot: {path} is not a regular file]'
+    try:
+        with open(path) as reboot_file:
+            text = reboot_file.read()
+    except OSError:
+        return f"[reboot: can't read {path}]"
+    try:
+        schedule = json.loads(text).get('schedule')
+    except (ValueError, AttributeError):
+        return '[reboot: ]' # jq fails, so the script prints an empty schedule
+    if schedule is None:
+        return ''
+    return '[reboot: {}]'.format(schedule if isinstance(schedule, str) else json.dumps(schedule))
+
+@prompt_segment('rust', per_dir=True, watch=lambda cwd, env: syncbin_rustup.watch_paths(cwd), ttl=60) # the TTL catches override directories being deleted
+def prompt_rust(cwd, env):
+    """Same output as `rprompt/rust.sh`, but reads rustup's settings directly instead of running `rust rprompt`."""
+    if not os.path.isdir(cwd):
+        return ''
+    if shutil.which('rust') is None:
+        return '[rust: unknown]'
+    try:
+        return syncbin_rustup.rprompt(pathlib.Path(cwd).resolve()) or ''
+    except (OSError, ValueError):
+        return run_script('rust', cwd, env)
+
+script_segment('screen', env=['STY'])
+script_segment('temperature', ttl=30)
+script_segment('venv', env=['VIRTUAL_ENV'])
+
+def signature(paths):
+    result = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            result.append(None)
+        else:
+            result.append([stat.st_ino, stat.st_mtime_ns, stat.st_size]) # lists rather than tuples so signatures survive a round trip through JSON
+    return result
+
+def cache_key(segment, cwd, env):
+    """Returns the key under which the segment's output is cached, and the environment variables it depends on."""
+    key_env = {name: env.get(name, '') for name in segment.env}
+    return (segment.segment_name, cwd if segment.per_dir else None, tuple(sorted(key_env.items()))), key_env
+
+persist_lock = threading.Lock()
+
+def persist_key():
+    return {'bootID': syncbin.boot_id(), 'kernel': os.uname().release}
+
+class CacheEntry:
+    def __init__(self, segment, cwd, env):
+        self.segment = segment
+        self.cwd = cwd
+        self.env = env
+        self.output = None
+        self.signature = None
+        self.computed_at = None
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock() # held while computing
+        if segment.persist:
+            persisted = syncbin.load_cache('prompt-segments.json', default={}).get(segment.segment_name, {})
+            if persisted.get('key') == persist_key():
+                self.output = persisted['output']
+                self.signature = persisted['signature']
+                self.computed_at = time.monotonic()
+
+    def is_valid(self):
+        return self.output is not None and self.signature == signature(self.segment.watch(self.cwd, self.env))
+
+    def is_expired(self):
+        return self.segment.ttl is not None and time.monotonic() - self.computed_at > self.segment.ttl
+
+    def compute(self):
+        with self.lock:
+            # watched paths are checked before running the segment so changes during the run cause another one
+            new_signature = signature(self.segment.watch(self.cwd, self.env))
+            self.output = compute_segment(self.segment, self.cwd, self.env, previous=self.output) # on failure, keep showing the last good output
+            self.signature = new_signature
+            self.computed_at = time.monotonic()
+            if self.segment.persist:
+                with persist_lock:
+                    persisted = syncbin.load_cache('prompt-segments.json', default={})
+                    persisted[self.segment.segment_name] = {'key': persist_key(), 'output': self.output, 'signature': self.signature}
+                    syncbin.save_cache('prompt-segments.json', persisted)
+
+class PromptCache:
+    def __init__(self):
+        self.entries = {}
+        self.entries_lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=2 * len(segment_names()) or 1) # twice the segments so background refreshes don't hold up a prompt
+        self.refreshing = set()
+
+    def entry(self, segment_name, cwd, env):
+        segment = get_segment(segment_name)
+        key, key_env = cache_key(segment, cwd, env)
+        with self.entries_lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = CacheEntry(segment, cwd, {**env, **key_env})
+        entry.last_used = time.monotonic()
+        return entry
+
+    def render(self, cwd, env):
+        entries = [self.entry(segment_name, cwd, env) for segment_name in segment_names()]
+        stale = []
+        for entry in entries:
+            if entry.is_valid():
+                if entry.is_expired():
+                    self.refresh_in_background(entry)
+            elif entry.segment.background:
+                self.refresh_in_background(entry)
+            else:
+                stale.append(entry)
+        for future in [self.executor.submit(entry.compute) for entry in stale]:
+            future.result()
+        return ''.join(entry.output or '' for entry in entries)
+
+    def refresh_in_background(self, entry):
+        with self.entries_lock:
+            if entry in self.refreshing:
+                return
+            self.refreshing.add(entry)
+
+        def refresh():
+            try:
+                entry.compute()
+            finally:
+                with self.entries_lock:
+                    self.refreshing.discard(entry)
+
+        self.executor.submit(refresh)
+
+    def refresh_loop(self, interval=1):
+        """Recomputes recently used segments whose watched files changed or whose TTL expired, so the next prompt doesn't have to wait for them."""
+        while True:
+            time.sleep(interval)
+            now = time.monotonic()
+            with self.entries_lock:
+                for key, entry in list(self.entries.items()):
+                    if now - entry.last_used > KEEP_UNUSED:
+                        del self.entries[key]
+                entries = list(self.entries.values())
+            for entry in entries:
+                if entry.output is not None and (entry.is_expired() or not entry.is_valid()):
+                    self.refresh_in_background(entry)
+
+def socket_dir(*, create=False):
+    """The directory containing the daemon's socket. This is $XDG_RUNTIME_DIR, which only the user can access, or a `syncbin-UID` directory in $TMPDIR or /tmp, which is created with mode 0700 if create is true.
+
+    Raises PermissionError if the latter isn't a directory only the user can access, e.g. because another user created it first, since anyone who can replace the socket could read the requests and inject prompt escapes into the responses.
+    """
+    import stat
+
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return runtime_dir
+    path = os.path.join(os.environ.get('TMPDIR') or '/tmp', f'syncbin-{os.getuid()}') # must match `syncbin-rprompt` in fenhl.zsh-theme
+    if create:
+        with contextlib.suppress(FileExistsError):
+            os.mkdir(path, 0o700)
+    path_stat = os.lstat(path)
+    if not stat.S_ISDIR(path_stat.st_mode) or path_stat.st_uid != os.getuid() or path_stat.st_mode & 0o077:
+        raise PermissionError(f'{path} is not a directory only the current user can access')
+    return path
+
+def socket_path(*, create=False):
+    return os.path.join(socket_dir(create=create), f'syncbin-prompt-{os.getuid()}.sock')
+
+def parse_request(data):
+    cwd, *env_items = data.split(b'\0')
+    env = {}
+    for item in env_items:
+        name, sep, value = item.decode('utf-8', errors='replace').partition('=')
+        if sep:
+            env[name] = value
+    return os.fsdecode(cwd), env
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data = b''
+        while not data.endswith(b'\0\0'):
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return
+            data += chunk
+        self.server.last_request = time.monotonic()
+        cwd, env = parse_request(data[:-2])
+        try:
+            rendered = self.server.cache.render(cwd, env)
+        except Exception as e:
+            rendered = f'[prompt-daemon: {e.__class__.__name__}]'
+        self.request.sendall(rendered.encode('utf-8'))
+
+class PromptServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path, RequestHandler)
+        self.cache = PromptCache()
+        self.last_request = time.monotonic()
+
+def run_daemon(*, idle_timeout=IDLE_TIMEOUT):
+    """Serves the RPROMPT on socket_path() until no requests have been made for idle_timeout seconds. Exits immediately if another daemon is running."""
+    try:
+        path = socket_path(create=True)
+    except PermissionError as e:
+        print(f'[!!!!] not starting the prompt daemon: {e}', file=sys.stderr)
+        return
+    try:
+        daemon_lock = syncbin.lock(f'prompt-daemon-{os.getuid()}', timeout=0)
+        daemon_lock.acquire()
+    except TimeoutError:
+        return
+    # don't exit with the shell that started the daemon, but clean up the socket when killed
+    with contextlib.suppress(OSError):
+        os.setsid()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path) # left behind by a daemon which crashed
+    # never make the socket accessible to other users, not even between binding and a chmod
+    old_umask = os.umask(0o077)
+    try:
+        server = PromptServer(path)
+    finally:
+        os.umask(old_umask)
+    try:
+        threading.Thread(target=server.cache.refresh_loop, daemon=True).start()
+
+        def exit_when_idle():
+            while time.monotonic() - server.last_request < idle_timeout:
+                time.sleep(10)
+            server.shutdown()
+
+        threading.Thread(target=exit_when_idle, daemon=True).start()
+        server.serve_forever()
+    finally:
+        server.server_close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+        daemon_lock.release()
+
+def fetch_rprompt(cwd=None, env=None, *, timeout=1):
+    """Requests the rendered RPROMPT from a running daemon. Raises OSError if no daemon is running, or if the socket isn't owned by the user."""
+    if cwd is None:
+        cwd = os.environ.get('PWD') or os.getcwd()
+    if env is None:
+        env = {name: os.environ.get(name, '') for name in CLIENT_ENV}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        path = socket_path()
+        if os.lstat(path).st_uid != os.getuid():
+            raise PermissionError(f'{path} is owned by another user')
+        sock.connect(path)
+        sock.sendall(b''.join([os.fsencode(cwd), b'\0', *(f'{name}={value}\0'.encode('utf-8') for name, value in env.items()), b'\0']))
+        response = b''
+        while chunk := sock.recv(4096):
+            response += chunk
+    return response.decode('utf-8', errors='replace')
+
+def bench(segment_names=None, cwd=None, *, runs=10, file=sys.stdout):
+    """Compares native segments with the scripts they replace in the given directory, checking that the outputs are the same."""
+    import statistics
+
+    if cwd is None:
+        cwd = os.environ.get('PWD') or os.getcwd()
+    env = {name: os.environ.get(name, '') for name in CLIENT_ENV}
+    if not segment_names:
+        segment_names = [segment_name for segment_name, segment in sorted(PROMPT_SEGMENTS.items()) if not segment.is_script and (RPROMPT_DIR / f'{segment_name}.sh').exists()]
+    max_len = max(len('segment'), *(len(segment_name) for segment_name in segment_names))
+    print('{}  {:>10}  {:>10}  {:>8}  output'.format('segment'.ljust(max_len), 'native', 'script', 'speedup'), file=file)
+    all_same = True
+    for segment_name in segment_names:
+        timings = {}
+        outputs = {}
+        for kind, f in (('native', get_segment(segment_name)), ('script', lambda cwd, env: run_script(segment_name, cwd, env))):
+            durations = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                outputs[kind] = f(cwd, env).rstrip('\n')
+                durations.append(time.perf_counter() - start)
+            timings[kind] = statistics.median(durations)
+        same = outputs['native'] == outputs['script']
+        all_same = all_same and same
+        print('{}  {:>9.1f}ms  {:>9.1f}ms  {:>7.1f}x  {}'.format(
+            segment_name.ljust(max_len),
+            timings['native'] * 1000,
+            timings['script'] * 1000,
+            timings['script'] / timings['native'],
+            'same' if same else 'DIFFERENT: {!r} (native) vs {!r} (script)'.format(outputs['native'], outputs['script']),
+        ), file=file)
+    return all_same
+
+def compute_segment(segment, cwd, env, previous=None):
+    """Returns the segment's output without trailing newlines, or previous (or nothing) if it fails."""
+    try:
+        return segment(cwd, env).rstrip('\n') # like $(…) in zsh
+    except Exception:
+        return previous or ''
+
+def render_once(cwd=None, env=None, *, deadline=0.3, file=sys.stdout):
+    """Prints the RPROMPT without a daemon, computing the segments concurrently.
+
+    Segments which take longer than deadline seconds, and background segments which need to be recomputed, are shown with their last output, or `…` if there is none. They're finished by a forked worker process after this function returns, so the prompt doesn't wait for them and their output is cached for next time. Outputs are cached in the syncbin cache directory and reused as long as the segment's watched paths haven't changed and its TTL hasn't expired.
+    """
+    import json
+    import selectors
+
+    if cwd is None:
+        cwd = os.environ.get('PWD') or os.getcwd()
+    if env is None:
+        env = {name: os.environ.get(name, '') for name in CLIENT_ENV}
+    names = segment_names()
+    cache = syncbin.load_cache('rprompt-cache.json', default={})
+    keys = {}
+    outputs = {}
+    for segment_name in names:
+        segment = get_segment(segment_name)
+        keys[segment_name] = json.dumps(cache_key(segment, cwd, env)[0])
+        cached = cache.get(keys[segment_name])
+        if (
+            cached is not None
+            and cached['signature'] == signature(segment.watch(cwd, env))
+            and (segment.ttl is None or time.time() - cached['computedAt'] < segment.ttl)
+        ):
+            outputs[segment_name] = cached['output']
+    to_run = [segment_name for segment_name in names if segment_name not in outputs]
+    if to_run:
+        read_fd, write_fd = os.pipe()
+        # fork before starting any threads
+        if os.fork() == 0:
+            try:
+                os.close(read_fd)
+                devnull = os.open(os.devnull, os.O_RDWR)
+                for fd in range(3):
+                    os.dup2(devnull, fd) # don't keep the prompt's command substitution open
+                with contextlib.suppress(OSError):
+                    os.setsid()
+                _render_worker(to_run, cwd, env, keys, cache, write_fd)
+            finally:
+                os._exit(0)
+        os.close(write_fd)
+        start = time.monotonic()
+        buf = b''
+        with selectors.DefaultSelector() as selector:
+            selector.register(read_fd, selectors.EVENT_READ)
+            # background segments are only computed for the next prompt
+            while not all(segment_name in outputs for segment_name in to_run if not get_segment(segment_name).background):
+                remaining = start + deadline - time.monotonic()
+                if remaining <= 0 or not selector.select(remaining):
+                    break
+                chunk = os.read(read_fd, 65536)
+                if not chunk:
+                    break
+                buf += chunk
+                *lines, buf = buf.split(b'\n')
+                for line in lines:
+                    segment_name, output = json.loads(line)
+                    outputs[segment_name] = output
+        os.close(read_fd)
+    for segment_name in names:
+        if segment_name not in outputs:
+            outputs[segment_name] = cache.get(keys[segment_name], {}).get('output', '…')
+    print(''.join(outputs[segment_name] for segment_name in names), end='', file=file, flush=True)
+
+def _render_worker(to_run, cwd, env, keys, cache, write_fd):
+    import json
+
+    def compute(segment_name):
+        segment = get_segment(segment_name)
+        new_signature = signature(segment.watch(cwd, env))
+        return new_signature, compute_segment(segment, cwd, env, previous=cache.get(keys[segment_name], {}).get('output'))
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(to_run)) as executor:
+        futures = {executor.submit(compute, segment_name): segment_name for segment_name in to_run}
+        for future in concurrent.futures.as_completed(futures):
+            segment_name = futures[future]
+            results[segment_name] = future.result()
+            with contextlib.suppress(OSError): # BrokenPipeError once the prompt has been printed
+                os.write(write_fd, json.dumps([segment_name, results[segment_name][1]]).encode('utf-8') + b'\n')
+    os.close(write_fd)
+    now = time.time()
+    cache = syncbin.load_cache('rprompt-cache.json', default={}) # reload in case another prompt updated it in the meantime
+    for segment_name, (new_signature, output) in results.items():
+        cache[keys[segment_name]] = {'output': output, 'signature': new_signature, 'computedAt': now}
+    syncbin.save_cache('rprompt-cache.json', {key: value for key, value in cache.items() if now - value['computedAt'] < KEEP_RENDERED})
+
+def bench_rprompt(cwd=None, env=None, *, runs=10, file=sys.stdout):
+    """Prints how long each segment takes to compute, slowest first, without using any cached output."""
+    import statistics
+
+    if cwd is None:
+        cwd = os.environ.get('PWD') or os.getcwd()
+    if env is None:
+        env = {name: os.environ.get(name, '') for name in CLIENT_ENV}
+    timings = {}
+    for segment_name in segment_names():
+        segment = get_segment(segment_name)
+        durations = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            compute_segment(segment, cwd, env)
+            durations.append(time.perf_counter() - start)
+        timings[segment_name] = statistics.median(durations), max(durations), 'script' if segment.is_script else 'native'
+    total = sum(median for median, _, _ in timings.values())
+    max_len = max(len('segment'), *(len(segment_name) for segment_name in timings))
+    print('{}  {:>6}  {:>10}  {:>10}  {:>6}'.format('segment'.ljust(max_len), 'kind', 'median', 'max', 'share'), file=file)
+    for segment_name, (median, maximum, kind) in sorted(timings.items(), key=lambda item: item[1][0], reverse=True):
+        print('{}  {:>6}  {:>9.1f}ms  {:>9.1f}ms  {:>5.1f}%'.format(segment_name.ljust(max_len), kind, median * 1000, maximum * 1000, 100 * median / total if total else 0), file=file)
+    print('[ ** ] one after another: {:.1f}ms, concurrently: at least {:.1f}ms (the slowest segment)'.format(total * 1000, max(median for median, _, _ in timings.values()) * 1000), file=file)
@@ -0,0 +1,202 @@
+"""Reads rustup's state from its files instead of running `rustup`.
+
+`rustup show` and `rustup override list` take hundreds of milliseconds, which is too slow for the prompt. The default toolchain and the directory overrides are in `$RUSTUP_HOME/settings.toml`, and toolchain files are found the same way rustup finds them, by walking up from the working directory. Parsed files are memoized by mtime. Functions raise ValueError if a file can't be parsed, in which case callers should fall back to the `rustup` binary.
+
+For `rust`, this also checks whether a toolchain is up to date without running `rustup update`. rustup records the SHA-256 of the channel manifest it last installed each toolchain from in `$RUSTUP_HOME/update-hashes`, and the dist server publishes the hash of the current manifest next to the manifest, so comparing the two only takes one small download.
+"""
+
+import os
+import pathlib
+import re
+
+DEFAULT_DIST_SERVER = 'https://static.rust-lang.org'
+UPDATE_HASH_LEN = 20 # rustup only records this many hex digits of each manifest hash
+TOOLCHAIN_FILES = ['rust-toolchain', 'rust-toolchain.toml'] # rustup prefers the first if both exist
+
+_memo = {}
+
+def rustup_home():
+    return pathlib.Path(os.environ.get('RUSTUP_HOME') or pathlib.Path.home() / '.rustup')
+
+def settings_path():
+    return rustup_home() / 'settings.toml'
+
+def _parse_toml(text):
+    try:
+        import tomllib
+    except ImportError:
+        pass # Python < 3.11
+    else:
+        try:
+            return tomllib.loads(text)
+        except tomllib.TOMLDecodeError as e:
+            raise ValueError(str(e)) from e
+    # rustup only writes `key = "string"` pairs and tables, which is all this needs to parse
+    import json
+
+    result = {}
+    table = result
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            table = result.setdefault(line[1:-1].strip(), {})
+            continue
+        key, sep, value = line.partition(' = ')
+        if not sep or not value.startswith('"'):
+            raise ValueError(f'unsupported TOML: {line!r}')
+        if key.startswith('"'):
+            key = json.loads(key)
+        table[key] = json.loads(value)
+    return result
+
+def _read(path, parse):
+    """Returns parse(contents of path), or None if the file doesn't exist. Memoized by the file's mtime."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = stat.st_ino, stat.st_mtime_ns, stat.st_size
+    if path not in _memo or _memo[path][0] != key:
+        with open(path, encoding='utf-8') as f:
+            _memo[path] = key, parse(f.read())
+    return _memo[path][1]
+
+def settings():
+    return _read(settings_path(), _parse_toml) or {}
+
+def short_name(toolchain):
+    """`nightly-x86_64-unknown-linux-gnu` → `nightly`, matching the output of the rust script."""
+    return toolchain.split('-')[0]
+
+def default_toolchain():
+    """The full name of the default toolchain, or None if there is none."""
+    return settings().get('default_toolchain')
+
+def directory_overrides():
+    """The overrides set with `rustup override set`, as a dict mapping paths to toolchains."""
+    return {pathlib.Path(path): toolchain for path, toolchain in settings().get('overrides', {}).items()}
+
+def installed_toolchains():
+    """Returns a dict mapping the name of each installed toolchain to a value which changes whenever that toolchain is updated or reinstalled.
+
+    rustup replaces a toolchain's channel manifest whenever it installs or updates the toolchain. Linked custom toolchains have no manifest, so the mtime of the link is used.
+    """
+    result = {}
+    try:
+        entries = list((rustup_home() / 'toolchains').iterdir())
+    except FileNotFoundError:
+        return result
+    for path in entries:
+        for stamp_path in (path / 'lib' / 'rustlib' / 'multirust-channel-manifest.toml', path):
+            try:
+                result[path.name] = os.stat(stamp_path, follow_symlinks=False).st_mtime_ns
+            except OSError:
+                continue
+            break
+    return result
+
+def full_name(toolchain):
+    """The name of the installed toolchain for a channel such as `stable` or `nightly-2024-01-01`, including the host triple. None if the channel isn't installed, or it's ambiguous because it's installed for several hosts."""
+    if toolchain is None:
+        return None
+    try:
+        names = [path.name for path in (rustup_home() / 'toolchains').iterdir()]
+    except FileNotFoundError:
+        return None
+    if toolchain in names and re.search('-[a-z0-9_]+-[a-z0-9_]+-[a-z0-9_]+$', toolchain):
+        return toolchain # already a full name
+    # the character after the channel must start a host triple, not a date as in `nightly-2024-01-01`
+    candidates = [name for name in names if name.startswith(f'{toolchain}-') and not name[len(toolchain) + 1:][:1].isdigit()]
+    if len(candidates) == 1:
+        return candidates[0]
+
+def update_hash(toolchain):
+    """The hash of the channel manifest the toolchain (given by its full name) was last installed or updated from, or None if rustup didn't record it."""
+    try:
+        with (rustup_home() / 'update-hashes' / toolchain).open(encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def is_current(toolchain, latest_hash):
+    """Whether the toolchain (given by its full name) was installed from the channel manifest with the given hash."""
+    installed_hash = update_hash(toolchain)
+    return installed_hash is not None and installed_hash[:UPDATE_HASH_LEN] == latest_hash[:UPDATE_HASH_LEN]
+
+def installed_version(toolchain):
+    """The version of the toolchain (given by its full name) as listed in its channel manifest, e.g. `1.90.0 (1159e78c4 2025-09-14)`, or None if it can't be determined."""
+    def parse(text):
+        match = re.search(r'^\[pkg\.rust\]\nversion = "([^"]*)"$', text, re.MULTILINE)
+        return None if match is None else match.group(1)
+
+    try:
+        return _read(rustup_home() / 'toolchains' / toolchain / 'lib' / 'rustlib' / 'multirust-channel-manifest.toml', parse)
+    except OSError:
+        return None
+
+def channel_hash(toolchain, dist_server=DEFAULT_DIST_SERVER, *, timeout=10):
+    """Downloads the hash of the current channel manifest for a channel such as `stable`, `1.90` or `nightly-2024-01-01`. Raises OSError if it can't be downloaded."""
+    import urllib.request
+
+    match = re.fullmatch('(.+)-([0-9]{4}-[0-9]{2}-[0-9]{2})', toolchain)
+    if match:
+        url = '{}/dist/{}/channel-rust-{}.toml.sha256'.format(dist_server.rstrip('/'), match.group(2), match.group(1))
+    else:
+        url = '{}/dist/channel-rust-{}.toml.sha256'.format(dist_server.rstrip('/'), toolchain)
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        # same format as the output of `sha256sum`
+        fields = response.read().decode('utf-8', errors='replace').split()
+    if not fields:
+        raise OSError(f'empty response from {url}')
+    return fields[0]
+
+def _parse_toolchain_file(text):
+    if '[' not in text and '=' not in text:
+        # legacy format, just the toolchain name
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        if len(lines) != 1:
+            raise ValueError('invalid rust-toolchain file')
+        return lines[0]
+    toolchain = _parse_toml(text).get('toolchain', {})
+    if 'channel' in toolchain:
+        return toolchain['channel']
+    if 'path' in toolchain:
+        return toolchain['path']
+    raise ValueError('rust-toolchain file specifies neither channel nor path')
+
+def find_override(cwd=None):
+    """Returns the toolchain overriding the default in cwd and the path it's configured for, or (None, None) if there's no override.
+
+    Like rustup, this checks each directory from cwd upwards for a directory override, then for a toolchain file.
+    """
+    if cwd is None:
+        cwd = pathlib.Path().resolve()
+    cwd = pathlib.Path(cwd)
+    overrides = {path.resolve(): toolchain for path, toolchain in directory_overrides().items()}
+    for path in (cwd, *cwd.parents):
+        if path in overrides:
+            return overrides[path], path
+        for file_name in TOOLCHAIN_FILES:
+            toolchain = _read(path / file_name, _parse_toolchain_file)
+            if toolchain is not None:
+                return toolchain, path / file_name
+    return None, None
+
+def has_nonexistent_overrides():
+    """Whether `rustup override list` shows any overrides as `(not a directory)`."""
+    return any(not path.is_dir() for path in directory_overrides())
+
+def watch_paths(cwd):
+    """The files whose changes can change the result of find_override(cwd)."""
+    cwd = pathlib.Path(cwd)
+    return [settings_path(), *(path / file_name for path in (cwd, *cwd.parents) for file_name in TOOLCHAIN_FILES)]
+
+def rprompt(cwd=None):
+    """The Rust segment of the RPROMPT, or None if there's nothing to show."""
+    if has_nonexistent_overrides():
+        return '[rust: nonexistent]'
+    toolchain, _ = find_override(cwd)
+    if toolchain is not None:
+        return '[rust: {}]'.format(short_name(toolchain))
@@ -0,0 +1,441 @@
+"""Startup steps for `syncbin startup`.
+
+The steps form a dependency graph and run concurrently where their requirements and locks allow, so the network-bound steps don't wait for each other. Steps which change the state of the interactive shell (fpath, compinit, aliases) remain in the Zsh shim `syncbin-startup`, which runs `syncbin startup` first.
+"""
+
+import sys
+
+import concurrent.futures
+import contextlib
+import math
+import os
+import pathlib
+import platform
+import shutil
+import subprocess
+import threading
+import time
+
+import syncbin
+import syncbin_cron
+import syncbin_rustup
+
+STARTUP_STEPS = {}
+HISTORY_SIZE = 100 # number of runs kept for `syncbin startup-report`
+COMPLETIONS_DIR = pathlib.Path.home() / '.config' / 'syncbin' / 'zsh-completions'
+RUST_COMPLETIONS = {
+    '_rustup': ['rustup', 'completions', 'zsh'],
+    '_cargo': ['rustup', 'completions', 'zsh', 'cargo'],
+}
+
+def startup_step(step_name, *, requires=(), lock=None, internet=False):
+    """Registers a startup step.
+
+    The step runs after the steps named in requires have finished, while holding the syncbin lock with the given name, if any. Steps with internet=True are skipped if `syncbin hasinet` fails.
+    """
+    def inner_wrapper(f):
+        STARTUP_STEPS[step_name] = f
+        f.step_name = step_name
+        f.requirements = list(requires) + (['hasinet'] if internet else [])
+        f.lock_name = lock
+        f.needs_internet = internet
+        return f
+    return inner_wrapper
+
+class Startup:
+    """The state of one `syncbin startup` run, passed to each step."""
+
+    def __init__(self, *, ignore_lock=False, internet_test=True, file=sys.stdout):
+        self.ignore_lock = ignore_lock
+        self.internet_test = internet_test
+        self.file = file
+        self.has_internet = None
+        self.output_lock = threading.Lock()
+        self.running = set()
+        self.finished = set()
+        self.traces = {}
+        self._local = threading.local()
+        self.crontabs = None
+        self.crontabs_lock = threading.Lock()
+
+    def progress(self):
+        if not self.file.isatty():
+            return
+        if self.running:
+            bar = '[==..]' if self.has_internet is None else '[===.]'
+            message = 'running startup scripts: {}'.format(', '.join(sorted(self.running)))
+        else:
+            bar = message = ''
+        print('\r{} {}\x1b[K'.format(bar, message) if bar else '\r\x1b[K', end='\r', flush=True, file=self.file)
+
+    def print(self, *lines):
+        with self.output_lock:
+            if self.file.isatty():
+                print('\r\x1b[K', end='', file=self.file)
+            for line in lines:
+                print(line, file=self.file)
+            self.progress()
+
+    def warn(self, message):
+        self.print('[ !! ] warning: {}'.format(message))
+
+    def run(self, *args, check=False, **kwargs):
+        """Runs a subprocess for a step without terminal input. Unless stdout is redirected, the output is captured and printed once the subprocess exits, so concurrent steps don't garble each other's output."""
+        kwargs.setdefault('stdin', subprocess.DEVNULL)
+        capture = 'stdout' not in kwargs
+        if capture:
+            kwargs['stdout'] = subprocess.PIPE
+            kwargs.setdefault('stderr', subprocess.STDOUT)
+        result = self.subprocess(*args, encoding='utf-8', errors='replace', **kwargs)
+        if capture and result.stdout.strip():
+            self.print(*result.stdout.rstrip('\n').splitlines())
+        if check:
+            result.check_returncode()
+        return result
+
+    def subprocess(self, *args, **kwargs):
+        """Like subprocess.run, but counted in the trace of the current step."""
+        trace = getattr(self._local, 'trace', None)
+        if trace is not None:
+            trace['subprocesses'] += 1
+        result = subprocess.run(*args, **kwargs)
+        if trace is not None:
+            trace['returncodes'].append(result.returncode)
+        return result
+
+    def lock(self, lock_name, **kwargs):
+        if self.ignore_lock:
+            return contextlib.nullcontext()
+        return syncbin.lock(lock_name, **kwargs)
+
+    def has_cronjob(self, pattern):
+        """Checks the user's and root's crontabs for the pattern. The crontabs are read at most once per run."""
+        with self.crontabs_lock:
+            if self.crontabs is None:
+                self.crontabs = syncbin_cron.snapshot(run=self.subprocess)
+        return self.crontabs.find(pattern) is not None
+
+    def run_steps(self, steps=None):
+        """Runs the given steps (all registered steps by default) and their requirements. Returns a dict mapping each failed step to its exception."""
+        if steps is None:
+            steps = STARTUP_STEPS
+        pending = {}
+        stack = list(steps)
+        while stack:
+            step_name = stack.pop()
+            if step_name not in pending:
+                pending[step_name] = STARTUP_STEPS[step_name]
+                stack += STARTUP_STEPS[step_name].requirements
+        failures = {}
+        skipped_offline = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(pending), 1)) as executor:
+            running = {}
+            while pending or running:
+                for step_name, step in sorted(pending.items()):
+                    if not all(req in self.finished for req in step.requirements):
+                        continue
+                    del pending[step_name]
+                    if step.needs_internet and not self.has_internet:
+                        skipped_offline.append(step_name)
+                        self.traces[step_name] = {'skipped': True}
+                        self.finished.add(step_name)
+                    else:
+                        running[executor.submit(self.run_step, step)] = step_name
+                if not running:
+                    if pending:
+                        raise RuntimeError('No runnable startup steps left: {}'.format(', '.join(sorted(pending))))
+                    break
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    step_name = running.pop(future)
+                    try:
+                        future.result()
+                    except (Exception, SystemExit) as e: # some steps call bootstrap helpers which use sys.exit with an error message
+                        failures[step_name] = e
+                        if isinstance(e, SystemExit):
+                            self.warn('startup script {} failed{}'.format(step_name, '' if e.code is None else ': {}'.format(e.code)))
+                        else:
+                            self.warn('startup script {} failed: {}'.format(step_name, e))
+                    self.finished.add(step_name)
+        if skipped_offline:
+            self.warn('no internet connection, skipping some startup scripts')
+        with self.output_lock:
+            self.running.clear()
+            self.progress()
+        return failures
+
+    def run_step(self, step):
+        trace = self.traces[step.step_name] = {
+            'thread': threading.get_ident(),
+            'queued': time.time(),
+            'subprocesses': 0,
+            'returncodes': [],
+        }
+        self._local.trace = trace
+        try:
+            with self.lock(step.lock_name) if step.lock_name is not None else contextlib.nullcontext():
+                trace['start'] = time.time()
+                trace['lockWait'] = trace['start'] - trace['queued']
+                with self.output_lock:
+                    self.running.add(step.step_name)
+                    self.progress()
+                try:
+                    step(self)
+                except (Exception, SystemExit) as e:
+                    trace['error'] = '{}: {}'.format(e.__class__.__name__, e)
+                    raise
+                finally:
+                    trace['end'] = time.time()
+                    with self.output_lock:
+                        self.running.discard(step.step_name)
+                        self.progress()
+        finally:
+            self._local.trace = None
+
+    def write_trace(self, path):
+        """Writes the traces of the steps that ran to the given path, in Chrome's trace event format (viewable in chrome://tracing or Perfetto) if the path ends in .json, as one JSON object per step otherwise."""
+        import json
+
+        path = pathlib.Path(path)
+        if path.suffix == '.json':
+            threads = {}
+            events = []
+            for step_name, trace in sorted(self.traces.items(), key=lambda item: item[1].get('queued', 0)):
+                if 'start' not in trace:
+                    continue
+                tid = threads.setdefault(trace['thread'], len(threads) + 1)
+                if trace['lockWait'] > 0.001:
+                    events.append({
+                        'name': f'{step_name} (waiting for lock)',
+                        'cat': 'lock',
+                        'ph': 'X',
+                        'ts': trace['queued'] * 1e6,
+                        'dur': trace['lockWait'] * 1e6,
+                        'pid': os.getpid(),
+                        'tid': tid,
+                    })
+                events.append({
+                    'name': step_name,
+                    'cat': 'startup',
+                    'ph': 'X',
+                    'ts': trace['start'] * 1e6,
+                    'dur': (trace['end'] - trace['start']) * 1e6,
+                    'pid': os.getpid(),
+                    'tid': tid,
+                    'args': {key: value for key, value in trace.items() if key in ('lockWait', 'subprocesses', 'returncodes', 'error')},
+                })
+            with path.open('w') as trace_f:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_f, indent=4)
+                print(file=trace_f)
+        else:
+            with path.open('w') as trace_f:
+                for step_name, trace in sorted(self.traces.items(), key=lambda item: item[1].get('queued', 0)):
+                    print(json.dumps({'step': step_name, **{key: value for key, value in trace.items() if key != 'thread'}}), file=trace_f)
+
+    def record_history(self):
+        """Appends the step durations of this run to the history used by `syncbin startup-report`."""
+        import json
+
+        durations = {
+            step_name: trace['end'] - trace['start']
+            for step_name, trace in self.traces.items()
+            if 'end' in trace
+        }
+        if not durations:
+            return
+        started = [trace['queued'] for trace in self.traces.values() if 'queued' in trace]
+        record = {
+            'time': min(started),
+            'total': max(trace['end'] for trace in self.traces.values() if 'end' in trace) - min(started),
+            'steps': durations,
+        }
+        history_path = syncbin.cache_dir() / 'startup-history.jsonl'
+        try:
+            history_path.parent.mkdir(parents=True, exist_ok=True)
+            with history_path.open('a') as history_f:
+                print(json.dumps(record), file=history_f)
+            if history_path.stat().st_size > 2 * HISTORY_SIZE * len(json.dumps(record)):
+                with history_path.open() as history_f:
+                    lines = history_f.readlines()
+                with history_path.open('w') as history_f:
+                    history_f.writelines(lines[-HISTORY_SIZE:])
+        except OSError:
+            pass
+
+@startup_step('sync', lock='sync')
+def startup_sync(startup):
+    import syncbin_sync
+
+    for deployment, error in syncbin_sync.reconcile([syncbin_sync.ssh_config()]).items():
+        if error is not None:
+            startup.warn('{} {}: {}'.format('outdated' if deployment.target.exists() else 'missing', deployment.name, error))
+
+@startup_step('hasinet')
+def startup_hasinet(startup):
+    if startup.internet_test:
+        import syncbin_hasinet
+
+        startup.has_internet = syncbin_hasinet.has_internet()
+    else:
+        startup.has_internet = True
+
+@startup_step('apt', lock='debian', internet=True)
+def startup_apt(startup):
+    if shutil.which('apt-get-wrapper') is not None:
+        startup.run(['apt-get-wrapper'])
+
+# softwareupdate-wrapper consistently takes over a minute, so it's not a startup step for now
+
+@startup_step('xcode-select', lock='softwareupdate', internet=True)
+def startup_xcode_select(startup):
+    if shutil.which('xcode-select') is not None:
+        if startup.run(['xcode-select', '--install'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+            startup.warn('installing command-line tools, open Xcode.app to complete')
+
+@startup_step('brew', lock='ruby', internet=True)
+def startup_brew(startup):
+    if shutil.which('brew') is None:
+        if platform.system() == 'Darwin':
+            startup.warn('brew not installed, see http://brew.sh/ for instructions')
+    elif startup.has_cronjob('brew-wrapper'):
+        pass # brew upgrade has a cronjob, don't upgrade now
+    else:
+        startup.run(['brew-wrapper', '--startup'])
+
+@startup_step('rust', internet=True) # rust has its own lock
+def startup_rust(startup):
+    if shutil.which('rustup') is None:
+        if shutil.which('rustc') is not None:
+            startup.warn('rustup not installed')
+        return
+    try:
+        overridden = syncbin_rustup.find_override(os.getcwd())[0] is not None
+        default = syncbin_rustup.default_toolchain()
+        default = None if default is None else syncbin_rustup.short_name(default)
+    except (OSError, ValueError):
+        # couldn't read rustup's settings, ask rustup instead
+        overridden = startup.run(['rust', 'override'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode != 0
+        default = None if overridden else startup.run(['rust', 'default'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.strip()
+    if overridden:
+        startup.warn('Rust toolchain overridden for {}'.format(os.getcwd()))
+    elif default != 'stable':
+        startup.warn('Rust not defaulting to stable')
+    if startup.has_cronjob('rust'):
+        pass # rust update script has a cronjob, don't update now
+    else:
+        startup.run(['rust', '--quiet', '--no-project'])
+    update_rust_completions(startup)
+
+def content_hash(data):
+    import hashlib
+
+    return hashlib.sha256(data).hexdigest()
+
+def file_hash(path):
+    try:
+        with open(path, 'rb') as f:
+            return content_hash(f.read())
+    except OSError:
+        return None
+
+def update_rust_completions(startup):
+    """Regenerates the Zsh completions for rustup and cargo, unless the rustup binary is the same as last time and the completion files are unchanged.
+
+    `rustup completions zsh cargo` only prints a stub which sources the active toolchain's completions, so both files depend only on the version of rustup. A file is only replaced if its contents change, since replacing it invalidates the compinit dump built by `syncbin-startup`.
+    """
+    rustup_stat = os.stat(os.path.realpath(shutil.which('rustup')))
+    key = {'rustup': [rustup_stat.st_ino, rustup_stat.st_mtime_ns, rustup_stat.st_size]}
+    cached = syncbin.load_cache('rust-completions.json', default={})
+    if cached.get('key') == key and all(file_hash(COMPLETIONS_DIR / file_name) == content_hash for file_name, content_hash in cached.get('hashes', {}).items()):
+        return
+    COMPLETIONS_DIR.mkdir(parents=True, exist_ok=True)
+    hashes = {}
+    for file_name, cmd in RUST_COMPLETIONS.items():
+        completions = startup.run(cmd, stdout=subprocess.PIPE).stdout
+        if not completions:
+            return # try again next time
+        path = COMPLETIONS_DIR / file_name
+        hashes[file_name] = content_hash(completions.encode('utf-8'))
+        if file_hash(path) != hashes[file_name]:
+            tmp_path = path.with_name(f'.{file_name}.{os.getpid()}.tmp')
+            tmp_path.write_text(completions, encoding='utf-8')
+            tmp_path.replace(path)
+    syncbin.save_cache('rust-completions.json', {'key': key, 'hashes': hashes})
+
+@startup_step('gitdir', internet=True)
+def startup_gitdir(startup):
+    if pathlib.Path('/opt/hub').is_dir():
+        startup.warn('/opt/hub exists')
+    if (pathlib.Path.home() / 'hub').is_dir():
+        startup.warn('~/hub exists')
+    if startup.has_cronjob('gitdir update --quiet') or startup.has_cronjob('{}/github.com/fenhl/gitdir/master/gitdir/__main__.py update --quiet'.format(os.environ.get('GITDIR', '/opt/git'))):
+        pass # gitdir update has a cronjob, don't update now
+    elif shutil.which('gitdir') is not None:
+        try:
+            with startup.lock('gitdir', timeout=0):
+                startup.run(['gitdir', 'update'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except TimeoutError:
+            # another shell is already updating, wait for it to finish instead of updating again
+            with startup.lock('gitdir'):
+                pass
+    else:
+        startup.warn('gitdir not installed')
+
+@startup_step('syncbin-update', lock='syncbin-omz', internet=True)
+def startup_syncbin_update(startup):
+    if any((git_dir / 'fenhl.net' / 'syncbin-private' / 'master').is_dir() for git_dir in (pathlib.Path('/opt/git'), pathlib.Path.home() / 'git')):
+        startup.run(['syncbin', 'update'])
+    else:
+        startup.run(['syncbin', 'update', 'public'])
+
+@startup_step('oh-my-zsh-update', lock='syncbin-omz', internet=True)
+def startup_oh_my_zsh_update(startup):
+    startup.run(['oh-my-zsh', 'update'])
+
+@startup_step('sip')
+def startup_sip(startup):
+    if shutil.which('csrutil') is not None:
+        if 'disabled' in startup.run(['csrutil', 'status'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout:
+            startup.warn('System Integrity Protection is disabled')
+
+def run_startup(*, ignore_lock=False, internet_test=True, trace_path=None):
+    """Runs all startup steps. Returns the exit status for `syncbin startup`."""
+    startup = Startup(ignore_lock=ignore_lock, internet_test=internet_test)
+    failures = startup.run_steps()
+    startup.record_history()
+    if trace_path is not None:
+        startup.write_trace(trace_path)
+    return 1 if failures else 0
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list of values."""
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+def startup_report(last=20, file=sys.stdout):
+    import json
+
+    try:
+        with (syncbin.cache_dir() / 'startup-history.jsonl').open() as history_f:
+            lines = history_f.readlines()
+    except FileNotFoundError:
+        lines = []
+    runs = []
+    for line in lines[-last:]:
+        try:
+            runs.append(json.loads(line))
+        except ValueError:
+            continue # e.g. a line cut off by two logins writing at the same time
+    if not runs:
+        print('[ ** ] no startup runs recorded yet', file=file)
+        return
+    durations = {}
+    for run in runs:
+        for step_name, duration in run['steps'].items():
+            durations.setdefault(step_name, []).append(duration)
+    durations = sorted(durations.items(), key=lambda item: percentile(item[1], 0.95), reverse=True)
+    max_len = max(len('total'), *(len(step_name) for step_name, step_durations in durations))
+    print('[ ** ] startup durations over the last {} run{}:'.format(len(runs), '' if len(runs) == 1 else 's'), file=file)
+    print('{}  {:>4}  {:>8}  {:>8}  {:>8}'.format('step'.ljust(max_len), 'runs', 'p50', 'p95', 'max'), file=file)
+    for step_name, step_durations in [('total', [run['total'] for run in runs]), *durations]:
+        print('{}  {:>4}  {:>7.2f}s  {:>7.2f}s  {:>7.2f}s'.format(step_name.ljust(max_len), len(step_durations), percentile(step_durations, 0.5), percentile(step_durations, 0.95), max(step_durations)), file=file)
@@ -0,0 +1,216 @@
+"""Keeps track of the files syncbin deploys outside of its repos: the SSH config, `~/bin/batcharge`, and the symlinks in the Python module directory.
+
+Each deployment is recorded in a manifest in the syncbin cache directory, together with the content hash of the file and the inode, mtime, size, and mode of the target (and of the source, for copied files). Checking whether a deployment is current then only takes a `stat` of each file, and only files whose metadata changed since they were last recorded are hashed again or redeployed. `syncbin startup` reconciles all recorded deployments in one pass.
+"""
+
+import contextlib
+import os
+import pathlib
+import shutil
+import subprocess
+import threading
+
+import syncbin
+
+_manifest_lock = threading.Lock()
+
+class Deployment:
+    """A file deployed by syncbin: a copy of a file from a syncbin repo, a file with fixed contents, or a symlink."""
+
+    def __init__(self, name, target, *, source=None, contents=None, link=None, mode=None, sudo=False):
+        self.name = name # used in warnings
+        self.target = pathlib.Path(target).expanduser()
+        self.source = None if source is None else pathlib.Path(source)
+        self.contents = contents
+        self.link = None if link is None else pathlib.Path(link)
+        self.mode = mode
+        self.sudo = sudo # whether the target directory is only writable as root
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(value['name'], value['target'], source=value.get('source'), contents=value.get('contents'), link=value.get('link'), mode=value.get('mode'), sudo=value.get('sudo', False))
+
+    def to_json(self):
+        value = {'name': self.name, 'target': str(self.target), 'sudo': self.sudo}
+        if self.source is not None:
+            value['source'] = str(self.source)
+        if self.contents is not None:
+            value['contents'] = self.contents
+        if self.link is not None:
+            value['link'] = str(self.link)
+        if self.mode is not None:
+            value['mode'] = self.mode
+        return value
+
+    def source_signature(self):
+        if self.source is not None:
+            return stat_signature(self.source, follow_symlinks=True)
+        if self.contents is not None:
+            return content_hash(self.contents.encode('utf-8'))
+        return str(self.link)
+
+    def expected_hash(self):
+        if self.source is not None:
+            return file_hash(self.source)
+        if self.contents is not None:
+            return content_hash(self.contents.encode('utf-8'))
+
+    def matches(self, expected=None):
+        """Compares the target with what it should be. Returns the content hash to record, or None if the target is outdated. If expected is given, it is used as the hash of the source instead of hashing it again."""
+        if self.link is not None:
+            try:
+                return str(self.link) if os.readlink(self.target) == str(self.link) else None
+            except OSError:
+                return None
+        if self.target.is_symlink():
+            return None
+        if expected is None:
+            expected = self.expected_hash()
+        if expected is not None and file_hash(self.target) == expected:
+            if self.mode is None or stat_mode(self.target) == self.mode:
+                return expected
+
+    def install(self, *, interactive=False):
+        """Writes the target. If it's in a directory only root can write to, this uses `sudo`, which asks for a password only if interactive is true."""
+        if self.target.is_dir() and not self.target.is_symlink():
+            raise IsADirectoryError(f'{self.target} is a directory')
+        if self.sudo and not os.access(self.target.parent, os.W_OK):
+            sudo = ['sudo'] if interactive else ['sudo', '-n']
+            with contextlib.ExitStack() as stack:
+                if self.link is not None:
+                    cmd = [*sudo, 'ln', '-sfn', str(self.link), str(self.target)]
+                elif self.source is not None:
+                    cmd = [*sudo, 'cp', str(self.source), str(self.target)]
+                else:
+                    import tempfile
+
+                    # write the contents as the current user, then copy them into place as root
+                    tmp_f = stack.enter_context(tempfile.NamedTemporaryFile('w', encoding='utf-8', prefix=f'syncbin-{self.target.name}-'))
+                    tmp_f.write(self.contents)
+                    tmp_f.flush()
+                    cmd = [*sudo, 'cp', tmp_f.name, str(self.target)]
+                subprocess.run(cmd, stdin=None if interactive else subprocess.DEVNULL, check=True)
+            if self.mode is not None:
+                subprocess.run([*sudo, 'chmod', format(self.mode, 'o'), str(self.target)], stdin=None if interactive else subprocess.DEVNULL, check=True)
+            return
+        self.target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.target.with_name(f'.{self.target.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            if self.link is not None:
+                tmp_path.symlink_to(self.link)
+            else:
+                if self.source is not None:
+                    shutil.copyfile(self.source, tmp_path)
+                else:
+                    tmp_path.write_text(self.contents, encoding='utf-8')
+                if self.mode is not None:
+                    tmp_path.chmod(self.mode)
+            tmp_path.replace(self.target) # atomic, so other shells never see a partially written file
+        except BaseException:
+            with contextlib.suppress(OSError):
+                tmp_path.unlink()
+            raise
+
+def content_hash(data):
+    import hashlib
+
+    return hashlib.sha256(data).hexdigest()
+
+def file_hash(path):
+    try:
+        with open(path, 'rb') as f:
+            return content_hash(f.read())
+    except OSError:
+        return None
+
+def stat_mode(path):
+    import stat
+
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def stat_signature(path, *, follow_symlinks=False):
+    try:
+        stat = os.stat(path, follow_symlinks=follow_symlinks)
+    except OSError:
+        return None
+    return [stat.st_ino, stat.st_mtime_ns, stat.st_size, stat.st_mode]
+
+def load_manifest():
+    return syncbin.load_cache('sync-manifest.json', default={})
+
+def _record(deployment, content_hash):
+    with _manifest_lock:
+        manifest = load_manifest()
+        manifest[str(deployment.target)] = {
+            'deployment': deployment.to_json(),
+            'hash': content_hash,
+            'source': deployment.source_signature(),
+            'target': stat_signature(deployment.target),
+        }
+        syncbin.save_cache('sync-manifest.json', manifest)
+
+def is_current(deployment, *, manifest=None):
+    """Checks whether the deployment's target is what syncbin would deploy. This only compares file metadata with the manifest unless something changed since the last check."""
+    if manifest is None:
+        manifest = load_manifest()
+    record = manifest.get(str(deployment.target))
+    expected = None
+    if record is not None and record['deployment'] == deployment.to_json() and record['source'] == deployment.source_signature():
+        target_signature = stat_signature(deployment.target)
+        if target_signature is not None and record['target'] == target_signature:
+            return True
+        expected = record['hash'] # only the target changed, no need to hash the source again
+    content_hash = deployment.matches(expected)
+    if content_hash is None:
+        return False
+    _record(deployment, content_hash)
+    return True
+
+def deploy(deployment, *, interactive=False):
+    """Installs the deployment's target and records it in the manifest, so that `syncbin startup` keeps it up to date."""
+    deployment.install(interactive=interactive)
+    _record(deployment, deployment.matches())
+
+def reconcile(deployments=()):
+    """Redeploys any of the given deployments and the deployments recorded in the manifest which are outdated.
+
+    Returns a dict mapping each outdated deployment to None if it was redeployed, or to the exception which prevented redeploying it.
+    """
+    manifest = load_manifest()
+    all_deployments = {str(deployment.target): deployment for deployment in deployments}
+    for target, record in manifest.items():
+        all_deployments.setdefault(target, Deployment.from_json(record['deployment']))
+    result = {}
+    for deployment in all_deployments.values():
+        if is_current(deployment, manifest=manifest):
+            continue
+        if deployment.source is not None and not deployment.source.exists():
+            result[deployment] = FileNotFoundError(f'{deployment.source} not found')
+            continue
+        try:
+            deploy(deployment)
+        except (OSError, subprocess.CalledProcessError) as e:
+            result[deployment] = e
+        else:
+            result[deployment] = None
+    return result
+
+def ssh_config():
+    return Deployment('SSH config', '~/.ssh/config', source=syncbin.git_dir() / 'github.com' / 'fenhl' / 'syncbin' / 'master' / 'config' / 'ssh', mode=0o600) # http://serverfault.com/a/253314
+
+def batcharge_stub():
+    return Deployment('batcharge', '~/bin/batcharge', contents='#!/bin/sh\n\nexit 0\n', mode=0o755)
+
+def batcharge_macbook():
+    return Deployment('batcharge', '~/bin/batcharge', link=syncbin.git_dir() / 'fenhl.net' / 'syncbin-private' / 'master' / 'bin' / 'batcharge-macbook')
+
+def python_links():
+    """The symlinks in the Python module directory to modules in gitdir checkouts."""
+    links = {
+        'basedir': ('github.com', 'fenhl', 'python-xdg-basedir', 'master', 'basedir'),
+        'class_key.py': ('github.com', 'fenhl', 'python-class-key', 'master', 'class_key.py'),
+        'fancyio.py': ('github.com', 'fenhl', 'fancyio', 'master', 'fancyio.py'),
+        'lazyjson': ('github.com', 'fenhl', 'lazyjson', 'master', 'lazyjson'),
+        'timespec': ('github.com', 'fenhl', 'python-timespec', 'master', 'timespec'),
+    }
+    return [Deployment(f'{syncbin.py_dir()}/{link_name}', syncbin.py_dir() / link_name, link=syncbin.git_dir().joinpath(*link_path), sudo=True) for link_name, link_path in links.items()]
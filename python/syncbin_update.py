@@ -0,0 +1,149 @@
+"""Updates all repos managed by syncbin at once, for `syncbin update --all`.
+
+Fetching is network-bound, so the repos are fetched concurrently by a bounded pool of workers, each fetch with a timeout. The fetched changes are then applied one repo at a time in a fixed order: syncbin and syncbin-private are rebased onto their upstream like in `syncbin update`, followed by the syncbin update hooks if needed, while oh-my-zsh and the other gitdir checkouts are fast-forwarded. Finally, a table shows what happened to each repo.
+"""
+
+import sys
+
+import concurrent.futures
+import contextlib
+import os
+import pathlib
+import signal
+import subprocess
+import time
+
+import syncbin
+
+DEFAULT_JOBS = 8
+DEFAULT_TIMEOUT = 60 # seconds per fetch
+
+class Repo:
+    def __init__(self, name, path, *, rebase=False):
+        self.name = name
+        self.path = path
+        self.rebase = rebase # whether local commits are rebased onto the upstream instead of requiring a fast-forward
+        self.fetch_time = None
+        self.status = None
+        self.ok = True
+        self.changed = False
+
+    def fail(self, status):
+        self.status = status
+        self.ok = False
+
+    def git(self, *args, **kwargs):
+        return subprocess.run(['git', '-C', str(self.path), *args], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, encoding='utf-8', errors='replace', env=git_env(), **kwargs)
+
+    def rev_parse(self, rev):
+        result = self.git('rev-parse', '--verify', '--quiet', rev)
+        if result.returncode == 0:
+            return result.stdout.strip()
+
+def git_env():
+    # fetches run without a terminal, so they must fail instead of asking for credentials
+    env = {**os.environ, 'GIT_TERMINAL_PROMPT': '0'}
+    env.setdefault('GIT_SSH_COMMAND', 'ssh -o BatchMode=yes')
+    return env
+
+def gitdirs():
+    result = []
+    for path in (os.environ.get('GITDIR'), '/opt/git', pathlib.Path.home() / 'git'):
+        if path is not None and pathlib.Path(path).is_dir() and pathlib.Path(path).resolve() not in (gitdir.resolve() for gitdir in result):
+            result.append(pathlib.Path(path))
+    return result
+
+def managed_repos():
+    """Returns the repos to update, in the order in which they are applied."""
+    first = [
+        ('github.com/fenhl/syncbin', True),
+        ('fenhl.net/syncbin-private', True),
+        ('github.com/robbyrussell/oh-my-zsh', False),
+    ]
+    repos = {}
+    for gitdir in gitdirs():
+        for name, rebase in first:
+            if (gitdir / name / 'master' / '.git').exists():
+                repos.setdefault(name, Repo(name, gitdir / name / 'master', rebase=rebase))
+    for gitdir in gitdirs():
+        # gitdir checkouts are at host/user/repo/master, or host/repo/master for hosts without users
+        for git_path in sorted((*gitdir.glob('*/*/master/.git'), *gitdir.glob('*/*/*/master/.git'))):
+            path = git_path.parent
+            name = str(path.parent.relative_to(gitdir))
+            if name not in repos:
+                repos[name] = Repo(name, path)
+    return list(repos.values())
+
+def fetch(repo, timeout):
+    start = time.monotonic()
+    # a new session so that a timeout also kills the ssh or https helpers of `git fetch`
+    with subprocess.Popen(['git', '-C', str(repo.path), 'fetch', '--quiet'], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=git_env(), start_new_session=True) as process:
+        try:
+            returncode = process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+            repo.fail('fetch timed out')
+        else:
+            if returncode != 0:
+                repo.fail('fetch failed')
+    repo.fetch_time = time.monotonic() - start
+
+def apply(repo):
+    head = repo.rev_parse('HEAD')
+    upstream = repo.rev_parse('@{u}')
+    if upstream is None:
+        repo.fail('no upstream')
+    elif head == upstream:
+        repo.status = 'up to date'
+    elif repo.rebase:
+        if repo.git('rebase', '--quiet', '@{u}').returncode == 0:
+            repo.changed = True
+            repo.status = 'rebased {}..{}'.format(head[:7], repo.rev_parse('HEAD')[:7])
+        else:
+            repo.git('rebase', '--abort')
+            repo.fail('rebase failed')
+    elif repo.git('merge-base', '--is-ancestor', 'HEAD', '@{u}').returncode != 0:
+        repo.fail('diverged from upstream')
+    elif repo.git('merge', '--ff-only', '--quiet', '@{u}').returncode == 0:
+        repo.changed = True
+        repo.status = 'updated {}..{}'.format(head[:7], upstream[:7])
+    else:
+        repo.fail('fast-forward failed')
+
+def read_version(path):
+    try:
+        with open(path) as version_f:
+            return version_f.read().strip()
+    except OSError:
+        return None
+
+def update_all(*, jobs=DEFAULT_JOBS, timeout=DEFAULT_TIMEOUT, file=sys.stdout):
+    """Fetches all managed repos concurrently, then applies the changes in order. Returns the exit status."""
+    start = time.monotonic()
+    repos = managed_repos()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for future in concurrent.futures.as_completed([executor.submit(fetch, repo, timeout) for repo in repos]):
+            future.result()
+    syncbin_repos = [repo for repo in repos if repo.rebase]
+    data_version = pathlib.Path(os.environ.get('XDG_DATA_HOME') or pathlib.Path.home() / '.local' / 'share') / 'syncbin' / 'version.txt'
+    old_version = read_version(data_version) or (read_version(syncbin_repos[0].path / 'version.txt') if syncbin_repos else None)
+    hooks_ok = True
+    with syncbin.lock('syncbin-omz'), syncbin.lock('gitdir'):
+        for repo in repos:
+            if repo.ok:
+                apply(repo)
+        if syncbin_repos and syncbin_repos[0].name == 'github.com/fenhl/syncbin':
+            new_version = read_version(syncbin_repos[0].path / 'version.txt')
+            if old_version is not None and new_version is not None and (old_version != new_version or any(repo.changed for repo in syncbin_repos)):
+                hooks_ok = subprocess.run(['syncbin', 'update', 'hooks', old_version, new_version]).returncode == 0
+    if repos:
+        max_len = max(len('repo'), *(len(repo.name) for repo in repos))
+        print('[ ** ] updated {} repo{} in {:.2f}s:'.format(len(repos), '' if len(repos) == 1 else 's', time.monotonic() - start), file=file)
+        print('{}  {:>8}  {}'.format('repo'.ljust(max_len), 'fetch', 'status'), file=file)
+        for repo in repos:
+            print('{}  {:>7.2f}s  {}'.format(repo.name.ljust(max_len), repo.fetch_time, repo.status), file=file)
+    else:
+        print('[ ** ] no repos to update', file=file)
+    return 0 if hooks_ok and all(repo.ok for repo in repos) else 1